@@ -4,11 +4,16 @@ from collections import namedtuple
 
 from .connection import connect, Connection, TIMEOUT as DEFAULT_TIMEOUT
 from .cursor import Cursor
-from .pool import create_pool, Pool
+from .manager import PoolManager
+from .pool import (create_pool, Pool, PoolTimeoutError, PoolOverloadedError,
+                   PoolCircuitOpenError)
+from .routing import create_routing_pool, RoutingPool
 
 
-__all__ = ('connect', 'create_pool', 'Connection', 'Cursor', 'Pool',
-           'version', 'version_info', 'DEFAULT_TIMEOUT')
+__all__ = ('connect', 'create_pool', 'create_routing_pool', 'Connection',
+           'Cursor', 'Pool', 'RoutingPool', 'PoolManager', 'PoolTimeoutError',
+           'PoolOverloadedError', 'PoolCircuitOpenError', 'version',
+           'version_info', 'DEFAULT_TIMEOUT')
 
 __version__ = '0.13.1'
 
@@ -42,4 +47,5 @@ version_info = _parse_version(__version__)
 
 
 # make pyflakes happy
-(connect, create_pool, Connection, Cursor, Pool, DEFAULT_TIMEOUT)
+(connect, create_pool, Connection, Cursor, Pool, PoolTimeoutError,
+ PoolOverloadedError, PoolCircuitOpenError, DEFAULT_TIMEOUT)
@@ -1,8 +1,12 @@
 import asyncio
 import contextlib
 import errno
+import ipaddress
+import os
 import select
+import socket
 import sys
+import threading
 import traceback
 import warnings
 import weakref
@@ -13,8 +17,15 @@ from psycopg2.extensions import (
     POLL_OK, POLL_READ, POLL_WRITE, POLL_ERROR)
 from psycopg2 import extras
 
+try:
+    from psycopg2.extensions import parse_dsn, libpq_version
+except ImportError:  # pragma: no cover
+    # psycopg2 < 2.7 can't merge a dsn with keyword arguments
+    parse_dsn = libpq_version = None
+
 from .cursor import Cursor
-from .utils import _ContextManager, PY_35, create_future
+from .log import logger
+from .utils import _ContextManager, PY_35, create_future, ensure_future
 
 
 __all__ = ('connect',)
@@ -23,6 +34,20 @@ __all__ = ('connect',)
 TIMEOUT = 60.0
 PY_341 = sys.version_info >= (3, 4, 1)
 
+# seconds to wait for a connection attempt to a host before racing it
+# with an attempt to the next host
+ATTEMPT_DELAY = 0.25
+
+# (host, port) targets of multi-host connects -> the target connected
+# last, it is tried first next time
+_preferred_targets = {}
+
+# side connections sending cancellation requests at the same time, the
+# blocking PQcancel() is used when all of them are busy
+CANCEL_CONNECTIONS = 4
+_cancel_slots = threading.BoundedSemaphore(CANCEL_CONNECTIONS)
+
+
 # Windows specific error code, not in errno for some reason, and doesnt map
 # to OSError.errno EBADF
 WSAENOTSOCK = 10038
@@ -47,46 +72,235 @@ def _enable_hstore(conn):
 
 
 def connect(dsn=None, *, timeout=TIMEOUT, loop=None, enable_json=True,
-            enable_hstore=True, enable_uuid=True, echo=False, **kwargs):
+            enable_hstore=True, enable_uuid=True, echo=False,
+            attempt_delay=ATTEMPT_DELAY, **kwargs):
     """A factory for connecting to PostgreSQL.
 
     The coroutine accepts all parameters that psycopg2.connect() does
     plus optional keyword-only `loop` and `timeout` parameters.
 
+    *host* may be a list of hosts (or a comma separated string),
+    attempts to connect to them are raced, a next host is tried after
+    *attempt_delay* seconds or a failure of the previous one.
+
     Returns instantiated Connection object.
 
     """
     coro = _connect(dsn=dsn, timeout=timeout, loop=loop,
                     enable_json=enable_json, enable_hstore=enable_hstore,
-                    enable_uuid=enable_uuid, echo=echo, **kwargs)
+                    enable_uuid=enable_uuid, echo=echo,
+                    attempt_delay=attempt_delay, **kwargs)
     return _ContextManager(coro)
 
 
 @asyncio.coroutine
 def _connect(dsn=None, *, timeout=TIMEOUT, loop=None, enable_json=True,
-             enable_hstore=True, enable_uuid=True, echo=False, **kwargs):
+             enable_hstore=True, enable_uuid=True, echo=False,
+             attempt_delay=ATTEMPT_DELAY, **kwargs):
     if loop is None:
         loop = asyncio.get_event_loop()
 
+    targets = _connect_targets(dsn, kwargs)
+    if len(targets) == 1:
+        host, port = targets[0]
+        kwargs = dict(kwargs, host=host, port=port)
+    elif targets:
+        return (yield from _race_targets(
+            targets, attempt_delay, loop,
+            lambda host, port: _connect_host(
+                dsn, timeout, loop, enable_json, enable_hstore,
+                enable_uuid, echo, dict(kwargs, host=host, port=port))))
+    return (yield from _connect_host(dsn, timeout, loop, enable_json,
+                                     enable_hstore, enable_uuid, echo,
+                                     kwargs))
+
+
+def _split_list(value):
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    return str(value).split(',')
+
+
+def _connect_targets(dsn, kwargs):
+    """Return a list of (host, port) pairs of a multi-host connect.
+
+    An empty list is returned for a single host, it is left to libpq.
+    """
+    host = kwargs.get('host')
+    port = kwargs.get('port')
+    if (host is None or port is None) and dsn and parse_dsn is not None:
+        try:
+            params = parse_dsn(dsn)
+        except psycopg2.ProgrammingError:
+            # let psycopg2.connect() report a broken dsn
+            return []
+        if host is None:
+            host = params.get('host')
+        if port is None:
+            port = params.get('port')
+    if host is None or not isinstance(host, (list, tuple)) \
+            and ',' not in str(host):
+        return []
+    hosts = _split_list(host)
+    if port is None or port == '':
+        ports = [None] * len(hosts)
+    else:
+        ports = _split_list(port)
+        if len(ports) == 1:
+            ports *= len(hosts)
+        elif len(ports) != len(hosts):
+            raise psycopg2.OperationalError(
+                "could not match {} port numbers to {} hosts".format(
+                    len(ports), len(hosts)))
+    return [(host or None, port or None) for host, port in zip(hosts, ports)]
+
+
+@asyncio.coroutine
+def _race_targets(targets, attempt_delay, loop, attempt):
+    # happy eyeballs: a next host is tried when the previous attempt
+    # fails or doesn't succeed in attempt_delay seconds, the first
+    # connection wins, the host connected last time is tried first
+    key = tuple(targets)
+    targets = list(targets)
+    preferred = _preferred_targets.get(key)
+    if preferred is not None:
+        targets.remove(preferred)
+        targets.insert(0, preferred)
+    started = {}
+    pending = set()
+    errors = []
+    winner = None
+    try:
+        while targets or pending:
+            if targets:
+                target = targets.pop(0)
+                task = ensure_future(attempt(*target), loop=loop)
+                started[task] = target
+                pending.add(task)
+            done, pending = yield from asyncio.wait(
+                pending, timeout=attempt_delay if targets else None,
+                return_when=asyncio.FIRST_COMPLETED, loop=loop)
+            for task in done:
+                exc = task.exception()
+                if exc is None:
+                    winner = task
+                    break
+                errors.append((started[task], exc))
+            if winner is not None:
+                break
+    finally:
+        losers = [task for task in started if task is not winner]
+        for task in losers:
+            task.cancel()
+        if losers:
+            # cancelled attempts close their sockets
+            yield from asyncio.wait(losers, loop=loop)
+        for task in losers:
+            if not task.cancelled() and task.exception() is None:
+                # connected simultaneously with the winner
+                task.result().close()
+    if winner is not None:
+        _preferred_targets[key] = started[winner]
+        return winner.result()
+    if len(errors) == 1:
+        raise errors[0][1]
+    raise psycopg2.OperationalError(
+        "could not connect to any host:\n" + "\n".join(
+            '{}:{}: {!r}'.format(host, port or '', exc)
+            for (host, port), exc in errors)) from errors[-1][1]
+
+
+@asyncio.coroutine
+def _connect_host(dsn, timeout, loop, enable_json, enable_hstore,
+                  enable_uuid, echo, kwargs):
+    hostaddr = yield from asyncio.wait_for(
+        _resolve_hostaddr(dsn, kwargs, loop), timeout, loop=loop)
+    if hostaddr is not None:
+        kwargs = dict(kwargs, **hostaddr)
+
     waiter = create_future(loop)
     conn = Connection(dsn, loop, timeout, waiter, bool(echo), **kwargs)
     try:
         yield from conn._poll(waiter, timeout)
-    except Exception:
+        conn._connected = True
+        yield from conn._record_backend()
+        if enable_json:
+            extras.register_default_json(conn._conn)
+        if enable_uuid:
+            extras.register_uuid(conn_or_curs=conn._conn)
+        if enable_hstore:
+            oids = yield from _enable_hstore(conn)
+            if oids is not None:
+                oid, array_oid = oids
+                extras.register_hstore(conn._conn, oid=oid,
+                                       array_oid=array_oid)
+    except BaseException:
+        # including cancellation by a won connection race
         conn.close()
         raise
-    if enable_json:
-        extras.register_default_json(conn._conn)
-    if enable_uuid:
-        extras.register_uuid(conn_or_curs=conn._conn)
-    if enable_hstore:
-        oids = yield from _enable_hstore(conn)
-        if oids is not None:
-            oid, array_oid = oids
-            extras.register_hstore(conn._conn, oid=oid, array_oid=array_oid)
     return conn
 
 
+@asyncio.coroutine
+def _resolve_hostaddr(dsn, kwargs, loop):
+    """Resolve the server host name without blocking the loop.
+
+    libpq resolves host names synchronously inside psycopg2.connect(),
+    passing the resolved addresses as *hostaddr* avoids that.  The
+    original *host* is kept for SSL verification and password lookup.
+
+    Returns extra connection parameters or None if libpq should be
+    left alone: unix sockets, numeric addresses, multiple hosts or an
+    explicit *hostaddr*.
+    """
+    if parse_dsn is None:  # pragma: no cover
+        return None
+    params = {}
+    if dsn:
+        try:
+            params.update(parse_dsn(dsn))
+        except psycopg2.ProgrammingError:
+            # let psycopg2.connect() report a broken dsn
+            return None
+    params.update(kwargs)
+    if params.get('hostaddr') or os.environ.get('PGHOSTADDR'):
+        return None
+    host = params.get('host') or os.environ.get('PGHOST')
+    if not host or host.startswith('/') or ',' in str(host):
+        return None
+    try:
+        ipaddress.ip_address(host)
+        return None
+    except ValueError:
+        pass
+    port = params.get('port') or os.environ.get('PGPORT') or 5432
+    if ',' in str(port):
+        return None
+
+    try:
+        infos = yield from loop.getaddrinfo(host, port,
+                                            type=socket.SOCK_STREAM)
+    except socket.gaierror as exc:
+        raise psycopg2.OperationalError(
+            'could not translate host name "{}" to address: {}'.format(
+                host, exc.strerror)) from exc
+    addrs = []
+    for family, type, proto, canonname, sockaddr in infos:
+        if sockaddr[0] not in addrs:
+            addrs.append(sockaddr[0])
+    if len(addrs) > 1 and libpq_version() < 100000:
+        # libpq < 10 doesn't accept lists, it can fall back to the next
+        # address itself only if it resolves the name
+        return None
+    return {'host': ','.join([host] * len(addrs)),
+            'hostaddr': ','.join(addrs)}
+
+
+def _timeout_waiter(waiter):
+    if not waiter.done():
+        waiter.set_exception(asyncio.TimeoutError())
+
+
 def _is_bad_descriptor_error(os_error):
     if platform.system() == 'Windows':  # pragma: no cover
         return os_error.winerror == WSAENOTSOCK
@@ -94,6 +308,18 @@ def _is_bad_descriptor_error(os_error):
         return os_error.errno == errno.EBADF
 
 
+def _status(impl):
+    return impl.statusmessage
+
+
+def _all_rows(impl):
+    return impl.fetchall()
+
+
+def _first_row(impl):
+    return impl.fetchone()
+
+
 class Connection:
     """Low-level asynchronous interface for wrapped psycopg2 connection.
 
@@ -107,15 +333,25 @@ class Connection:
     def __init__(self, dsn, loop, timeout, waiter, echo, **kwargs):
         self._loop = loop
         self._conn = psycopg2.connect(dsn, async=True, **kwargs)
+        self._connect_params = (dsn, kwargs)
         self._dsn = self._conn.dsn
         assert self._conn.isexecuting(), "Is conn an async at all???"
         self._fileno = self._conn.fileno()
+        # the socket is shared with children forked later
+        self._pid = os.getpid()
         self._timeout = timeout
         self._last_usage = self._loop.time()
         self._waiter = waiter
         self._writing = False
         self._cancelling = False
         self._cancellation_waiter = None
+        self._cancel_latency = None
+        # a connection being established is closed on timeout, not
+        # cancelled; so is a side connection sending a cancellation
+        self._connected = False
+        self._side = False
+        # (pid, backend_start) of the server session
+        self._backend = None
         self._echo = echo
         self._notifies = asyncio.Queue(loop=loop)
         self._weakref = weakref.ref(self)
@@ -218,30 +454,24 @@ class Connection:
         assert waiter is self._waiter, (waiter, self._waiter)
         self._ready(self._weakref)
 
-        @asyncio.coroutine
-        def cancel():
-            self._waiter = create_future(self._loop)
-            self._cancelling = True
-            self._cancellation_waiter = self._waiter
-            self._conn.cancel()
-            if not self._conn.isexecuting():
-                return
-            try:
-                yield from asyncio.wait_for(self._waiter, timeout,
-                                            loop=self._loop)
-            except psycopg2.extensions.QueryCanceledError:
-                pass
-            except asyncio.TimeoutError:
-                self._close()
-
+        # a single timer handle per operation is much cheaper than
+        # asyncio.wait_for() which wraps the waiter into another future
+        timeout_handle = None
+        if timeout is not None and not waiter.done():
+            timeout_handle = self._loop.call_later(timeout,
+                                                   _timeout_waiter, waiter)
         try:
-            yield from asyncio.wait_for(self._waiter, timeout, loop=self._loop)
+            yield from waiter
         except (asyncio.CancelledError, asyncio.TimeoutError) as exc:
-            yield from asyncio.shield(cancel(), loop=self._loop)
+            if self._connected and not self._side:
+                yield from asyncio.shield(self._cancel_poll(timeout),
+                                          loop=self._loop)
             raise exc
         except psycopg2.extensions.QueryCanceledError:
             raise asyncio.CancelledError
         finally:
+            if timeout_handle is not None:
+                timeout_handle.cancel()
             if self._cancelling:
                 self._cancelling = False
                 if self._waiter is self._cancellation_waiter:
@@ -250,6 +480,84 @@ class Connection:
             else:
                 self._waiter = None
 
+    @asyncio.coroutine
+    def _cancel_poll(self, timeout):
+        waiter = self._waiter = create_future(self._loop)
+        self._cancelling = True
+        self._cancellation_waiter = waiter
+        yield from self._cancel_request(timeout)
+        if not waiter.done() and not self._conn.isexecuting():
+            return
+        timeout_handle = None
+        if timeout is not None:
+            timeout_handle = self._loop.call_later(timeout,
+                                                   _timeout_waiter, waiter)
+        try:
+            yield from waiter
+        except psycopg2.extensions.QueryCanceledError:
+            pass
+        except asyncio.TimeoutError:
+            self._close()
+        finally:
+            if timeout_handle is not None:
+                timeout_handle.cancel()
+
+    @asyncio.coroutine
+    def _record_backend(self):
+        # pg_cancel_backend() has no secret key check, remember the
+        # session start to tell it from another one reusing the pid
+        try:
+            self._backend = yield from self._query(
+                "SELECT pid, backend_start FROM pg_stat_activity "
+                "WHERE pid = pg_backend_pid()",
+                None, None, '_record_backend', _first_row)
+        except psycopg2.ProgrammingError as exc:
+            logger.debug("Cannot identify the server session: %r", exc)
+
+    @asyncio.coroutine
+    def _cancel_request(self, timeout):
+        # psycopg2's cancel() opens a new socket and waits for the server
+        # answer holding the GIL, so running it in a thread would still
+        # block the loop.  Send the request through pg_cancel_backend()
+        # over a short-lived side connection instead and fall back to
+        # the blocking call if that connection cannot be made.
+        started = self._loop.time()
+        try:
+            if self._backend is None \
+                    or self._backend[0] != self._conn.get_backend_pid():
+                # the session is unknown or behind a connection pooler
+                self._conn.cancel()
+            elif not _cancel_slots.acquire(blocking=False):
+                self._conn.cancel()
+            else:
+                try:
+                    yield from self._cancel_backend(timeout)
+                except (psycopg2.Error, asyncio.TimeoutError,
+                        asyncio.CancelledError, OSError) as exc:
+                    logger.warning("Cannot cancel query without blocking: "
+                                   "%r", exc)
+                    self._conn.cancel()
+                finally:
+                    _cancel_slots.release()
+        finally:
+            self._cancel_latency = self._loop.time() - started
+
+    @asyncio.coroutine
+    def _cancel_backend(self, timeout):
+        dsn, kwargs = self._connect_params
+        waiter = create_future(self._loop)
+        conn = Connection(dsn, self._loop, timeout, waiter, False, **kwargs)
+        # never cancelled itself, closed on timeout
+        conn._side = True
+        try:
+            yield from conn._poll(waiter, timeout)
+            yield from conn._query(
+                "SELECT pg_cancel_backend(pid) FROM pg_stat_activity "
+                "WHERE pid = %s AND backend_start = %s",
+                self._backend, timeout, 'cancel', _first_row)
+        finally:
+            conn.close()
+
     def _isexecuting(self):
         return self._conn.isexecuting()
 
@@ -277,13 +585,12 @@ class Connection:
         if timeout is None:
             timeout = self._timeout
 
-        impl = yield from self._cursor_impl(name=name,
-                                            cursor_factory=cursor_factory,
-                                            scrollable=scrollable,
-                                            withhold=withhold)
+        impl = self._cursor_impl(name=name,
+                                 cursor_factory=cursor_factory,
+                                 scrollable=scrollable,
+                                 withhold=withhold)
         return Cursor(self, impl, timeout, self._echo)
 
-    @asyncio.coroutine
     def _cursor_impl(self, name=None, cursor_factory=None,
                      scrollable=None, withhold=False):
         if cursor_factory is None:
@@ -294,10 +601,73 @@ class Connection:
                                      scrollable=scrollable, withhold=withhold)
         return impl
 
+    @asyncio.coroutine
+    def execute(self, operation, parameters=None, *, timeout=None):
+        """Execute a query, return the status message of the command.
+
+        E.g. ``'INSERT 0 1'``. Unlike :meth:`cursor` no
+        :class:`Cursor` object is created.
+
+        """
+        return (yield from self._query(operation, parameters, timeout,
+                                       'execute', _status))
+
+    @asyncio.coroutine
+    def fetch(self, operation, parameters=None, *, timeout=None):
+        """Execute a query, return all result rows as a list."""
+        return (yield from self._query(operation, parameters, timeout,
+                                       'fetch', _all_rows))
+
+    @asyncio.coroutine
+    def fetchrow(self, operation, parameters=None, *, timeout=None):
+        """Execute a query, return the first result row or None."""
+        return (yield from self._query(operation, parameters, timeout,
+                                       'fetchrow', _first_row))
+
+    @asyncio.coroutine
+    def fetchval(self, operation, parameters=None, *, column=0,
+                 timeout=None):
+        """Execute a query, return a *column* of the first result row.
+
+        None is returned if the query returns no rows.
+
+        """
+        row = yield from self._query(operation, parameters, timeout,
+                                     'fetchval', _first_row)
+        if row is None:
+            return None
+        return row[column]
+
+    @asyncio.coroutine
+    def _query(self, operation, parameters, timeout, func_name, result):
+        # the short path behind fetch() & co: a bare psycopg2 cursor,
+        # no Cursor wrapper and no context managers
+        if timeout is None:
+            timeout = self._timeout
+        self._last_usage = self._loop.time()
+        impl = self._conn.cursor()
+        try:
+            waiter = self._create_waiter(func_name)
+            if self._echo:
+                logger.info(operation)
+                logger.info("%r", parameters)
+            try:
+                impl.execute(operation, parameters)
+            except BaseException:
+                self._waiter = None
+                raise
+            yield from self._poll(waiter, timeout)
+            return result(impl)
+        finally:
+            impl.close()
+
     def _close(self):
         """Remove the connection from the event_loop and close it."""
         # N.B. If connection contains uncommitted transaction the
         # transaction will be discarded
+        if self._pid != os.getpid():
+            self._close_forked()
+            return
         if self._fileno is not None:
             self._loop.remove_reader(self._fileno)
             if self._writing:
@@ -308,6 +678,20 @@ class Connection:
             self._waiter.set_exception(
                 psycopg2.OperationalError("Connection closed"))
 
+    def _close_forked(self):
+        # the connection is inherited from the parent process which
+        # still uses the socket and the event loop selector: don't touch
+        # the selector and let psycopg2 send Terminate message into
+        # a /dev/null duplicate of the socket descriptor
+        if self._fileno is not None and not self._conn.closed:
+            devnull = os.open(os.devnull, os.O_RDWR)
+            try:
+                os.dup2(devnull, self._fileno)
+            finally:
+                os.close(devnull)
+        self._fileno = None
+        self._conn.close()
+
     def close(self):
         self._close()
         ret = create_future(self._loop)
@@ -373,14 +757,15 @@ class Connection:
     @asyncio.coroutine
     def cancel(self):
         """Cancel the current database operation."""
-        if self._waiter is None:
+        waiter = self._waiter
+        if waiter is None:
             return
 
         @asyncio.coroutine
         def cancel():
-            self._conn.cancel()
+            yield from self._cancel_request(self._timeout)
             try:
-                yield from self._waiter
+                yield from waiter
             except psycopg2.extensions.QueryCanceledError:
                 pass
 
@@ -494,6 +879,15 @@ class Connection:
         """Return default timeout for connection operations."""
         return self._timeout
 
+    @property
+    def cancel_latency(self):
+        """Return time in seconds spent on the last cancellation request.
+
+        ``None`` if no query was cancelled on the connection yet.
+
+        """
+        return self._cancel_latency
+
     @property
     def last_usage(self):
         """Return time() when connection was used."""
@@ -0,0 +1,223 @@
+import asyncio
+import threading
+import weakref
+
+from .pool import _create_pool
+from .utils import create_future
+
+
+__all__ = ('PoolManager',)
+
+
+def _call_in_loop(loop, callback, *args):
+    # the loop may belong to another thread or be closed already
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        pass
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class _ConnectionBudget:
+    """A limit of connections shared by pools of different event loops.
+
+    Every pool connection owns a token of the budget from opening till
+    closing. All methods are thread-safe.
+    """
+
+    def __init__(self, limit):
+        self._limit = limit
+        self._used = 0
+        self._lock = threading.Lock()
+        # (loop, future) pairs of coroutines waiting for a token
+        self._waiters = []
+        self._pools = weakref.WeakSet()
+        # pools waiting for the budget to grow
+        self._hungry = weakref.WeakSet()
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @property
+    def used(self):
+        return self._used
+
+    @property
+    def remaining(self):
+        # a hint, may be stale by the time it is used
+        return max(self._limit - self._used, 0)
+
+    def register(self, pool):
+        with self._lock:
+            self._pools.add(pool)
+
+    @asyncio.coroutine
+    def acquire(self, loop):
+        while True:
+            with self._lock:
+                if self._used < self._limit:
+                    self._used += 1
+                    return
+                waiter = create_future(loop)
+                self._waiters.append((loop, waiter))
+            yield from waiter
+
+    def release(self):
+        with self._lock:
+            self._used -= 1
+            waiters, self._waiters = self._waiters, []
+            pools = list(self._pools)
+        # woken coroutines and pools compete for the token, pools check
+        # their waiters in their own threads
+        for loop, waiter in waiters:
+            _call_in_loop(loop, _wake, waiter)
+        for pool in pools:
+            _call_in_loop(pool._loop, pool._budget_released)
+
+    def request(self, requester):
+        """Ask a pool with free connections to give one up.
+
+        If there is no such pool the next pool getting a connection
+        back gives it up, see :meth:`wanted`.
+        """
+        with self._lock:
+            self._hungry.add(requester)
+            pools = [pool for pool in self._pools
+                     if pool is not requester and pool.freesize]
+        if pools:
+            pool = max(pools, key=lambda pool: pool.freesize)
+            _call_in_loop(pool._loop, pool._shed_free)
+
+    def wanted(self, pool):
+        """Are connections of *pool* wanted by other pools."""
+        if not self._hungry:
+            return False
+        with self._lock:
+            for other in list(self._hungry):
+                if not other._waiting or other._closing:
+                    self._hungry.discard(other)
+            return any(other is not pool for other in self._hungry)
+
+
+class PoolManager:
+    """Connection pools of a single DSN for many event loops.
+
+    A pool is created for every event loop on demand, all the pools
+    share *max_connections* limit. The manager may be used from
+    different threads.
+    """
+
+    def __init__(self, dsn=None, *, max_connections=None, **kwargs):
+        if max_connections is not None and max_connections < 1:
+            raise ValueError(
+                "max_connections should be None or greater than zero")
+        self._dsn = dsn
+        self._kwargs = kwargs
+        self._budget = None
+        if max_connections is not None:
+            self._budget = _ConnectionBudget(max_connections)
+        self._lock = threading.Lock()
+        self._pools = {}
+        # loop -> asyncio.Lock serializing pool creation in the loop
+        self._creating = {}
+        self._closed = False
+
+    @property
+    def max_connections(self):
+        return None if self._budget is None else self._budget.limit
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def pools(self):
+        """A list of pools of all event loops."""
+        with self._lock:
+            return list(self._pools.values())
+
+    @asyncio.coroutine
+    def get_pool(self, *, loop=None):
+        """Return the pool of *loop*, create it if needed."""
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        pool = self._get_pool(loop)
+        if pool is not None:
+            return pool
+        with self._lock:
+            lock = self._creating.get(loop)
+            if lock is None:
+                lock = self._creating[loop] = asyncio.Lock(loop=loop)
+        with (yield from lock):
+            pool = self._get_pool(loop)
+            if pool is not None:
+                return pool
+            pool = yield from _create_pool(self._dsn, loop=loop,
+                                           budget=self._budget,
+                                           **self._kwargs)
+            with self._lock:
+                if not self._closed:
+                    self._pools[loop] = pool
+                    return pool
+            pool.close()
+            yield from pool.wait_closed()
+            raise RuntimeError("PoolManager is closed")
+
+    def _get_pool(self, loop):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("PoolManager is closed")
+            pool = self._pools.get(loop)
+        if pool is not None and not pool._closing:
+            return pool
+        return None
+
+    @asyncio.coroutine
+    def close_pool(self, *, loop=None):
+        """Close the pool of *loop* and wait for its closing."""
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        with self._lock:
+            pool = self._pools.pop(loop, None)
+            self._creating.pop(loop, None)
+        if pool is not None:
+            pool.close()
+            yield from pool.wait_closed()
+
+    def close(self):
+        """Close all the pools.
+
+        Pools of other threads are closed in their event loops, use
+        :meth:`close_pool` in every thread to wait for the closing.
+        """
+        with self._lock:
+            self._closed = True
+            pools = list(self._pools.values())
+        for pool in pools:
+            _call_in_loop(pool._loop, pool.close)
+
+    def stats(self):
+        """Return statistics aggregated over the pools as a dict.
+
+        Pools of other threads are read without synchronization, the
+        numbers may be slightly inconsistent.
+        """
+        pools = self.pools
+        stats = {'pools': len(pools),
+                 'max_connections': self.max_connections,
+                 'budget_used': None}
+        if self._budget is not None:
+            stats['budget_used'] = self._budget.used
+        for name in ('size', 'freesize'):
+            stats[name] = sum(getattr(pool, name) for pool in pools)
+        stats['used'] = sum(len(pool._used) for pool in pools)
+        stats['waiting'] = sum(pool._waiting for pool in pools)
+        for name in ('acquired', 'created', 'closed', 'timeouts',
+                     'connect_errors'):
+            stats[name] = sum(getattr(pool.metrics, name) for pool in pools)
+        return stats
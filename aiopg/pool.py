@@ -1,31 +1,103 @@
 import asyncio
+import bisect
 import collections
+import itertools
+import os
+import random
+import select
 import sys
 import warnings
+import weakref
 
 
+import psycopg2
 from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 
-from .connection import connect, TIMEOUT
+from .connection import (connect, Connection, TIMEOUT, _all_rows,
+                         _first_row, _status)
 from .log import logger
+from .stats import Histogram, PoolMetrics, WorkloadMetrics
 from .utils import (PY_35, _PoolContextManager, _PoolConnectionContextManager,
                     _PoolCursorContextManager, _PoolAcquireContextManager,
-                    ensure_future, create_future)
+                    create_future, ensure_future)
 
 
 PY_341 = sys.version_info >= (3, 4, 1)
 
+# max_lifetime is shortened by a random part of up to 10% for every
+# connection, connections opened together don't expire together
+LIFETIME_JITTER = 0.1
+
+# seconds between maintenance runs unless max_idle or max_lifetime
+# require more frequent ones
+MAINTENANCE_INTERVAL = 1.0
+
+# maximal delay between reconnection attempts of the maintenance task
+MAINTENANCE_BACKOFF_MAX = 30.0
+
+# timeout of SELECT 1 sent by pre_ping_idle check, a silently dropped
+# connection should not hold acquire() for the whole query timeout
+PRE_PING_TIMEOUT = 5.0
+
+# connections found broken by pre_ping one acquire() replaces in a row
+# besides the free ones it started with, a server closing every new
+# connection fails the acquire instead of a reconnection loop
+PRE_PING_RETRIES = 3
+
+# maximal time the circuit breaker stays open between probes
+BREAKER_TIMEOUT_MAX = 60.0
+
+# acquire wait quantile compared with target_wait by adaptive sizing
+ADAPTIVE_QUANTILE = 0.95
+
+# idle tenants kept with their metrics, busy ones are kept anyway
+RECENT_TENANTS = 1000
+
+# seconds drain() waits for cancellation of queries still running after
+# its timeout before closing their connections anyway
+DRAIN_CANCEL_TIMEOUT = 1.0
+
+
+class PoolTimeoutError(asyncio.TimeoutError):
+    """No connection was released within the acquire timeout."""
+
+
+class PoolOverloadedError(RuntimeError):
+    """Too many coroutines are waiting for a connection already."""
+
+
+class PoolCircuitOpenError(psycopg2.OperationalError):
+    """New connections are not opened after repeated failures."""
+
 
 def create_pool(dsn=None, *, minsize=1, maxsize=10,
                 loop=None, timeout=TIMEOUT, pool_recycle=-1,
                 enable_json=True, enable_hstore=True, enable_uuid=True,
-                echo=False, on_connect=None,
+                echo=False, on_connect=None, on_acquire=None,
+                on_release=None, max_connecting=10, max_waiters=None,
+                max_idle=None, max_lifetime=None, min_idle=0,
+                strategy='fifo', pre_ping=False, pre_ping_idle=None,
+                breaker_threshold=None, breaker_timeout=1.0,
+                starvation_timeout=1.0, partitions=None, tenant_limit=None,
+                tenant_weights=None, task_affinity=False, target_wait=None,
                 **kwargs):
     coro = _create_pool(dsn=dsn, minsize=minsize, maxsize=maxsize, loop=loop,
                         timeout=timeout, pool_recycle=pool_recycle,
                         enable_json=enable_json, enable_hstore=enable_hstore,
                         enable_uuid=enable_uuid, echo=echo,
-                        on_connect=on_connect, **kwargs)
+                        on_connect=on_connect, on_acquire=on_acquire,
+                        on_release=on_release, max_connecting=max_connecting,
+                        max_waiters=max_waiters, max_idle=max_idle,
+                        max_lifetime=max_lifetime, min_idle=min_idle,
+                        strategy=strategy, pre_ping=pre_ping,
+                        pre_ping_idle=pre_ping_idle,
+                        breaker_threshold=breaker_threshold,
+                        breaker_timeout=breaker_timeout,
+                        starvation_timeout=starvation_timeout,
+                        partitions=partitions, tenant_limit=tenant_limit,
+                        tenant_weights=tenant_weights,
+                        task_affinity=task_affinity, target_wait=target_wait,
+                        **kwargs)
     return _PoolContextManager(coro)
 
 
@@ -33,31 +105,318 @@ def create_pool(dsn=None, *, minsize=1, maxsize=10,
 def _create_pool(dsn=None, *, minsize=1, maxsize=10,
                  loop=None, timeout=TIMEOUT, pool_recycle=-1,
                  enable_json=True, enable_hstore=True, enable_uuid=True,
-                 echo=False, on_connect=None,
-                 **kwargs):
+                 echo=False, on_connect=None, on_acquire=None,
+                 on_release=None, max_connecting=10, max_waiters=None,
+                 max_idle=None, max_lifetime=None, min_idle=0,
+                 strategy='fifo', pre_ping=False, pre_ping_idle=None,
+                 breaker_threshold=None, breaker_timeout=1.0,
+                 starvation_timeout=1.0, partitions=None,
+                 tenant_limit=None, tenant_weights=None, task_affinity=False,
+                 target_wait=None, budget=None, strict=True, **kwargs):
     if loop is None:
         loop = asyncio.get_event_loop()
 
     pool = Pool(dsn, minsize, maxsize, loop, timeout,
                 enable_json=enable_json, enable_hstore=enable_hstore,
                 enable_uuid=enable_uuid, echo=echo, on_connect=on_connect,
-                pool_recycle=pool_recycle, **kwargs)
-    if minsize > 0:
-        with (yield from pool._cond):
-            yield from pool._fill_free_pool(False)
+                on_acquire=on_acquire, on_release=on_release,
+                pool_recycle=pool_recycle, max_connecting=max_connecting,
+                max_waiters=max_waiters, max_idle=max_idle,
+                max_lifetime=max_lifetime, min_idle=min_idle,
+                strategy=strategy, pre_ping=pre_ping,
+                pre_ping_idle=pre_ping_idle,
+                breaker_threshold=breaker_threshold,
+                breaker_timeout=breaker_timeout,
+                starvation_timeout=starvation_timeout,
+                partitions=partitions, tenant_limit=tenant_limit,
+                tenant_weights=tenant_weights, task_affinity=task_affinity,
+                target_wait=target_wait, budget=budget, **kwargs)
+    if minsize > 0 or min_idle > 0:
+        try:
+            yield from pool._fill_free_pool(min_idle)
+        except (psycopg2.Error, asyncio.TimeoutError, OSError) as exc:
+            if strict:
+                raise
+            # the pool is filled on acquire when the server is back
+            logger.warning("Cannot open initial pool connections: %r", exc)
+    pool._start_maintenance()
     return pool
 
 
+def _readable(fd):
+    # select() fails for descriptors above FD_SETSIZE, poll() has no
+    # such limit but is missing on Windows
+    if not hasattr(select, 'poll'):  # pragma: no cover
+        readable, _, _ = select.select([fd], [], [], 0)
+        return bool(readable)
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    return bool(poller.poll(0))
+
+
+def _socket_alive(conn):
+    # no round trip check: an idle connection has nothing to read
+    # except notifications unless the server is closing it, e.g. the
+    # FATAL error of pg_terminate_backend() followed by EOF; None is
+    # returned if the socket can't be checked
+    if conn.closed:
+        return False
+    try:
+        readable = _readable(conn._fileno)
+    except (OSError, ValueError, TypeError) as exc:
+        logger.debug("Cannot check pooled connection socket: %r", exc)
+        return None
+    if not readable:
+        return True
+    notifies = conn._notifies.qsize()
+    Connection._ready(conn._weakref)
+    # anything but a notification means the connection is not
+    # trustworthy, replacing a good one costs just a reconnect
+    return not conn.closed and conn._notifies.qsize() > notifies
+
+
+class _WaiterQueue:
+    """Coroutines waiting for a connection, grouped by priority.
+
+    Waiters of a higher priority are served first. Waiters of the same
+    priority are served in FIFO order unless they belong to a *flow*
+    (a tenant), flows share the pool in proportion to their weights by
+    self-clocked fair queuing. A waiter waiting for
+    *starvation_timeout* seconds or longer is served first regardless
+    of its priority. Cancelled and timed out waiters are dropped
+    lazily.
+
+    Every waiter has a *key* (a pool workload), :meth:`pop` may skip
+    waiters whose key is not eligible for a connection now.
+    """
+
+    __slots__ = ('_queues', '_priorities', '_starvation_timeout',
+                 '_vtime', '_seq')
+
+    def __init__(self, starvation_timeout):
+        # priority -> {key: deque of (tag, seq, waiter, enqueued_at, key)}
+        # tags of a key never decrease, so every deque is ordered by
+        # tag and a pop compares a head per waiting workload only
+        self._queues = {}
+        # negated priorities in ascending order
+        self._priorities = []
+        self._starvation_timeout = starvation_timeout
+        # virtual time, the tag of the last served waiter
+        self._vtime = 0.0
+        self._seq = itertools.count()
+
+    def append(self, waiter, priority, now, key=None, flow=None):
+        """Add a waiter.
+
+        *flow* is an optional object with ``weight`` and ``finish``
+        attributes, a flow of weight 2 is served twice as often as a
+        flow of weight 1 while both are waiting.
+        """
+        keys = self._queues.get(priority)
+        if keys is None:
+            keys = self._queues[priority] = {}
+            bisect.insort(self._priorities, -priority)
+        queue = keys.get(key)
+        if queue is None:
+            queue = keys[key] = collections.deque()
+        if flow is None:
+            tag = self._vtime + 1.0
+        else:
+            tag = flow.finish = (max(flow.finish, self._vtime) +
+                                 1.0 / flow.weight)
+        queue.append((tag, next(self._seq), waiter, now, key))
+
+    def pop(self, now, eligible=None):
+        """Remove the next waiter to serve, return (waiter, key) pair.
+
+        *eligible* is an optional predicate on waiter keys. ``(None,
+        None)`` is returned if there is no waiter to serve.
+        """
+        chosen = oldest = None
+        for priority in self._priorities:
+            keys = self._queues[-priority]
+            best = None
+            empty = None
+            for key, queue in keys.items():
+                while queue and queue[0][2].done():
+                    queue.popleft()
+                if not queue:
+                    if empty is None:
+                        empty = []
+                    empty.append(key)
+                    continue
+                if eligible is not None and not eligible(key):
+                    continue
+                head = queue[0]
+                if best is None or head < best[0]:
+                    best = queue
+                if oldest is None or head[3] < oldest[0][3]:
+                    oldest = queue
+            if empty is not None:
+                for key in empty:
+                    del keys[key]
+            if chosen is None:
+                chosen = best
+        if chosen is None:
+            return None, None
+        if self._starvation_timeout is not None \
+                and now - oldest[0][3] >= self._starvation_timeout:
+            chosen = oldest
+        tag, _, waiter, _, key = chosen.popleft()
+        self._vtime = max(self._vtime, tag)
+        return waiter, key
+
+    def depths(self):
+        """Return a count of waiting coroutines per priority."""
+        depths = {}
+        for priority, keys in self._queues.items():
+            count = sum(1 for queue in keys.values() for entry in queue
+                        if not entry[2].done())
+            if count:
+                depths[priority] = count
+        return depths
+
+    def clear(self):
+        """Remove and return all not done waiters."""
+        waiters = [entry[2] for keys in self._queues.values()
+                   for queue in keys.values() for entry in queue
+                   if not entry[2].done()]
+        self._queues.clear()
+        del self._priorities[:]
+        return waiters
+
+
+class _Partition:
+    """A share of pool connections reserved for a workload."""
+
+    __slots__ = ('name', 'min', 'max', 'used', 'waiting', 'metrics')
+
+    def __init__(self, name, min, max):
+        self.name = name
+        self.min = min
+        self.max = max
+        # connections held by or being handed over to the partition
+        self.used = 0
+        self.waiting = 0
+        self.metrics = WorkloadMetrics()
+
+    def snapshot(self):
+        stats = self.metrics.snapshot()
+        stats.update(min=self.min, max=self.max, used=self.used,
+                     waiting=self.waiting)
+        return stats
+
+
+def _parse_partitions(partitions, maxsize):
+    if not partitions:
+        return None
+    if not maxsize:
+        raise ValueError("partitions require limited maxsize")
+
+    def share(value):
+        # floats are fractions of maxsize
+        if isinstance(value, float):
+            return int(value * maxsize)
+        return value
+
+    result = {}
+    for name, (low, high) in partitions.items():
+        if name is None:
+            raise ValueError("partition name should not be None")
+        low, high = share(low), share(high)
+        if not 0 <= low <= high <= maxsize:
+            raise ValueError(
+                "partition {!r} should have 0 <= min <= max <= maxsize, "
+                "got ({}, {})".format(name, low, high))
+        result[name] = _Partition(name, low, high)
+    if sum(part.min for part in result.values()) > maxsize:
+        raise ValueError("sum of partition minimums exceeds maxsize")
+    # acquiring without a partition uses the unreserved connections
+    result[None] = _Partition(None, 0, maxsize)
+    return result
+
+
+class _Tenant:
+    """Pool usage of a single tenant."""
+
+    __slots__ = ('name', 'weight', 'limit', 'used', 'waiting', 'finish',
+                 'metrics', '__weakref__')
+
+    def __init__(self, name, weight, limit):
+        self.name = name
+        self.weight = weight
+        self.limit = limit
+        self.used = 0
+        self.waiting = 0
+        # fair queuing tag of the last queued waiter
+        self.finish = 0.0
+        self.metrics = WorkloadMetrics()
+
+    def snapshot(self):
+        stats = self.metrics.snapshot()
+        stats.update(weight=self.weight, limit=self.limit, used=self.used,
+                     waiting=self.waiting)
+        return stats
+
+
+def _timeout_waiter(waiter):
+    if not waiter.done():
+        waiter.set_exception(PoolTimeoutError(
+            "Timeout while waiting for a free connection"))
+
+
 class Pool(asyncio.AbstractServer):
     """Connection pool"""
 
     def __init__(self, dsn, minsize, maxsize, loop, timeout, *,
                  enable_json, enable_hstore, enable_uuid, echo,
-                 on_connect, pool_recycle, **kwargs):
+                 on_connect, on_acquire, on_release, pool_recycle,
+                 max_connecting, max_waiters, max_idle, max_lifetime,
+                 min_idle, strategy, pre_ping, pre_ping_idle,
+                 breaker_threshold, breaker_timeout, starvation_timeout,
+                 partitions, tenant_limit, tenant_weights, task_affinity,
+                 target_wait, budget=None, **kwargs):
         if minsize < 0:
             raise ValueError("minsize should be zero or greater")
         if maxsize < minsize and maxsize != 0:
             raise ValueError("maxsize should be not less than minsize")
+        if max_connecting < 1:
+            raise ValueError("max_connecting should be greater than zero")
+        if max_waiters is not None and max_waiters < 0:
+            raise ValueError("max_waiters should be None, zero or greater")
+        if max_idle is not None and max_idle <= 0:
+            raise ValueError("max_idle should be None or greater than zero")
+        if max_lifetime is not None and max_lifetime <= 0:
+            raise ValueError(
+                "max_lifetime should be None or greater than zero")
+        if min_idle < 0:
+            raise ValueError("min_idle should be zero or greater")
+        if maxsize and min_idle > maxsize:
+            raise ValueError("min_idle should be not greater than maxsize")
+        if strategy not in ('fifo', 'lifo'):
+            raise ValueError("strategy should be 'fifo' or 'lifo'")
+        if pre_ping_idle is not None and pre_ping_idle < 0:
+            raise ValueError("pre_ping_idle should be None, zero or greater")
+        if breaker_threshold is not None and breaker_threshold < 1:
+            raise ValueError(
+                "breaker_threshold should be None or greater than zero")
+        if breaker_timeout <= 0:
+            raise ValueError("breaker_timeout should be greater than zero")
+        if starvation_timeout is not None and starvation_timeout < 0:
+            raise ValueError(
+                "starvation_timeout should be None, zero or greater")
+        if tenant_limit is not None and tenant_limit < 1:
+            raise ValueError(
+                "tenant_limit should be None or greater than zero")
+        if target_wait is not None:
+            if target_wait <= 0:
+                raise ValueError(
+                    "target_wait should be None or greater than zero")
+            if not maxsize:
+                raise ValueError("target_wait requires limited maxsize")
+        tenant_weights = dict(tenant_weights or {})
+        if any(weight <= 0 for weight in tenant_weights.values()):
+            raise ValueError("tenant weights should be greater than zero")
         self._dsn = dsn
         self._minsize = minsize
         self._loop = loop
@@ -68,12 +427,68 @@ class Pool(asyncio.AbstractServer):
         self._enable_uuid = enable_uuid
         self._echo = echo
         self._on_connect = on_connect
+        self._on_acquire = on_acquire
+        self._on_release = on_release
         self._conn_kwargs = kwargs
         self._acquiring = 0
+        self._max_connecting = max_connecting
+        # connection limit shared with pools of other event loops
+        self._budget = budget
+        self._connecting = asyncio.Semaphore(max_connecting, loop=loop)
         self._free = collections.deque(maxlen=maxsize or None)
-        self._cond = asyncio.Condition(loop=loop)
+        self._waiters = _WaiterQueue(starvation_timeout)
+        self._partitions = _parse_partitions(partitions, maxsize)
+        self._tenant_limit = tenant_limit
+        self._tenant_weights = tenant_weights
+        # tenants live while acquired connections, waiters or acquiring
+        # coroutines refer to them, recently used ones are kept
+        # strongly for their metrics
+        self._tenants = weakref.WeakValueDictionary()
+        self._recent_tenants = collections.OrderedDict()
+        # (partition, tenant) pairs of acquired connections
+        self._conn_workload = {}
+        self._task_affinity = task_affinity
+        # adaptive sizing keeps the pool within minsize and the current
+        # size limit, the limit moves between minsize and maxsize
+        self._target_wait = target_wait
+        self._size_limit = maxsize or None
+        if target_wait is not None:
+            self._size_limit = max(minsize, min_idle, 1)
+        self._window_wait = Histogram()
+        self._window_peak_used = 0
+        # connections shared by nested acquire() calls of a task
+        self._task_conns = {}
+        # shared connection -> [task, count of not released acquires]
+        self._task_refs = {}
+        self._eligible = None
+        if self._partitions is not None or tenant_limit is not None:
+            self._eligible = self._workload_allows
+        self._waiting = 0
+        self._max_waiters = max_waiters
+        self._max_idle = max_idle
+        self._max_lifetime = max_lifetime
+        self._min_idle = min_idle
+        self._lifo = strategy == 'lifo'
+        self._pre_ping = pre_ping or pre_ping_idle is not None
+        self._pre_ping_idle = pre_ping_idle
+        self._breaker_threshold = breaker_threshold
+        self._breaker_timeout = breaker_timeout
+        self._circuit_state = 'closed'
+        self._circuit_timeout = breaker_timeout
+        self._circuit_retry_at = None
+        self._circuit_probing = False
+        self._connect_failures = 0
+        self._expires_at = weakref.WeakKeyDictionary()
+        self._maintenance_task = None
         self._used = set()
+        self._acquired_at = {}
+        self._metrics = PoolMetrics()
         self._terminated = set()
+        # connections are not shared with children forked later
+        self._pid = os.getpid()
+        if budget is not None:
+            budget.register(self)
+        self._close_waiter = None
         self._closing = False
         self._closed = False
 
@@ -101,14 +516,98 @@ class Pool(asyncio.AbstractServer):
     def timeout(self):
         return self._timeout
 
+    @property
+    def max_waiters(self):
+        return self._max_waiters
+
+    @property
+    def max_idle(self):
+        return self._max_idle
+
+    @property
+    def max_lifetime(self):
+        return self._max_lifetime
+
+    @property
+    def min_idle(self):
+        return self._min_idle
+
+    @property
+    def strategy(self):
+        return 'lifo' if self._lifo else 'fifo'
+
+    @property
+    def pre_ping(self):
+        return self._pre_ping
+
+    @property
+    def pre_ping_idle(self):
+        return self._pre_ping_idle
+
+    @property
+    def partitions(self):
+        """Names of the pool partitions."""
+        if self._partitions is None:
+            return ()
+        return tuple(name for name in self._partitions if name is not None)
+
+    @property
+    def tenant_limit(self):
+        return self._tenant_limit
+
+    @property
+    def target_wait(self):
+        return self._target_wait
+
+    @property
+    def size_limit(self):
+        """Current upper bound of the pool size."""
+        return self._size_limit
+
+    @property
+    def task_affinity(self):
+        return self._task_affinity
+
+    @property
+    def circuit_state(self):
+        """Circuit breaker state: 'closed', 'open' or 'half-open'."""
+        if self._circuit_state == 'open' \
+                and self._loop.time() >= self._circuit_retry_at:
+            return 'half-open'
+        return self._circuit_state
+
+    @property
+    def metrics(self):
+        """Live pool metrics, updated in place."""
+        return self._metrics
+
+    def stats(self):
+        """Return a snapshot of pool statistics as a dict."""
+        stats = self._metrics.snapshot()
+        stats.update(size=self.size,
+                     freesize=self.freesize,
+                     used=len(self._used),
+                     minsize=self.minsize,
+                     maxsize=self.maxsize,
+                     waiting=self._waiting,
+                     size_limit=self._size_limit,
+                     waiting_by_priority=self._waiters.depths(),
+                     circuit_state=self.circuit_state)
+        if self._partitions is not None:
+            stats['partitions'] = {name: part.snapshot() for name, part
+                                   in self._partitions.items()}
+        if self._tenants:
+            stats['tenants'] = {name: tenant.snapshot() for name, tenant
+                                in list(self._tenants.items())}
+        return stats
+
     @asyncio.coroutine
     def clear(self):
         """Close all free connections in pool."""
-        with (yield from self._cond):
-            while self._free:
-                conn = self._free.popleft()
-                yield from conn.close()
-            self._cond.notify()
+        while self._free:
+            conn = self._free.popleft()
+            yield from self._close_connection(conn)
+            self._slot_freed()
 
     @property
     def closed(self):
@@ -123,6 +622,11 @@ class Pool(asyncio.AbstractServer):
         if self._closed:
             return
         self._closing = True
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+        for waiter in self._waiters.clear():
+            waiter.set_exception(RuntimeError(
+                "Cannot acquire connection after closing pool"))
 
     def terminate(self):
         """Terminate pool.
@@ -133,10 +637,17 @@ class Pool(asyncio.AbstractServer):
         self.close()
 
         for conn in list(self._used):
-            conn.close()
+            self._close_connection(conn)
             self._terminated.add(conn)
 
         self._used.clear()
+        self._acquired_at.clear()
+        self._conn_workload.clear()
+        for part in (self._partitions or {}).values():
+            part.used = 0
+        for tenant in list(self._tenants.values()):
+            tenant.used = 0
+        self._slot_freed()
 
     @asyncio.coroutine
     def wait_closed(self):
@@ -148,76 +659,656 @@ class Pool(asyncio.AbstractServer):
             raise RuntimeError(".wait_closed() should be called "
                                "after .close()")
 
+        if self._maintenance_task is not None:
+            yield from asyncio.wait([self._maintenance_task],
+                                    loop=self._loop)
+            self._maintenance_task = None
+
         while self._free:
             conn = self._free.popleft()
-            conn.close()
+            self._close_connection(conn)
 
-        with (yield from self._cond):
-            while self.size > self.freesize:
-                yield from self._cond.wait()
+        while self.size > self.freesize:
+            self._close_waiter = create_future(self._loop)
+            yield from self._close_waiter
+        self._close_waiter = None
 
         self._closed = True
 
-    def acquire(self):
-        """Acquire free connection from the pool."""
-        coro = self._acquire()
+    @asyncio.coroutine
+    def drain(self, timeout=None):
+        """Close the pool gracefully.
+
+        Stop acquiring, wait up to *timeout* seconds for acquired
+        connections to be released, cancel queries still running on
+        the rest and close them.
+        """
+        self.close()
+        closing = ensure_future(self.wait_closed(), loop=self._loop)
+        done, _ = yield from asyncio.wait([closing], timeout=timeout,
+                                          loop=self._loop)
+        if not done:
+            used = list(self._used)
+            logger.warning("Pool is not drained in %.1f seconds, "
+                           "cancelling queries of %d connections",
+                           timeout, len(used))
+            cancels = [ensure_future(conn.cancel(), loop=self._loop)
+                       for conn in used if not conn.closed]
+            if cancels:
+                _, pending = yield from asyncio.wait(
+                    cancels, timeout=DRAIN_CANCEL_TIMEOUT, loop=self._loop)
+                for fut in pending:
+                    fut.cancel()
+            self.terminate()
+            if cancels:
+                yield from asyncio.gather(*cancels, loop=self._loop,
+                                          return_exceptions=True)
+        yield from closing
+
+    def acquire(self, *, timeout=None, priority=0, partition=None,
+                tenant=None):
+        """Acquire free connection from the pool.
+
+        *timeout* limits the whole call including opening and
+        pre-pinging connections, PoolTimeoutError is raised when it
+        expires.
+
+        Waiters with higher *priority* are served first.
+
+        *partition* is a name of the pool partition the connection
+        is accounted to.
+
+        *tenant* is a hashable tenant id, tenants are limited by
+        *tenant_limit* connections and share the pool fairly.
+        """
+        coro = self._acquire(timeout, priority, partition, tenant)
         return _PoolAcquireContextManager(coro, self)
 
     @asyncio.coroutine
-    def _acquire(self):
+    def _acquire(self, timeout=None, priority=0, partition=None,
+                 tenant=None):
         if self._closing:
             raise RuntimeError("Cannot acquire connection after closing pool")
-        with (yield from self._cond):
-            while True:
-                yield from self._fill_free_pool(True)
-                if self._free:
-                    conn = self._free.popleft()
-                    assert not conn.closed, conn
-                    assert conn not in self._used, (conn, self._used)
-                    self._used.add(conn)
-                    if self._on_connect is not None:
-                        yield from self._on_connect(conn)
-                    return conn
+        if self._pid != os.getpid():
+            self._after_fork()
+        task = None
+        if self._task_affinity:
+            task = asyncio.Task.current_task(loop=self._loop)
+            conn = self._task_conns.get(task)
+            if conn is not None and not conn.closed:
+                # nested acquire, share the connection held by the task
+                self._task_refs[conn][1] += 1
+                self._metrics.shared += 1
+                return conn
+        workload = self._get_workload(partition, tenant)
+        started = self._loop.time()
+        # *timeout* limits the whole acquire including connecting
+        deadline = None if timeout is None else started + timeout
+        retries = len(self._free) + PRE_PING_RETRIES
+        broken = 0
+        while True:
+            self._drop_stale_free()
+            if self.size < self.minsize:
+                if deadline is None:
+                    yield from self._fill_free_pool()
                 else:
-                    yield from self._cond.wait()
+                    # the connections are opened for other acquires
+                    # even if this one times out
+                    left = self._time_left(deadline, workload)
+                    yield from self._within(
+                        asyncio.shield(self._fill_free_pool(),
+                                       loop=self._loop),
+                        left, deadline, workload)
+            if workload is not None and self._eligible is not None \
+                    and not self._eligible(workload):
+                conn = yield from self._wait_free(deadline, priority,
+                                                  workload)
+            elif self._free:
+                conn = self._pop_free()
+                self._reserve(workload)
+                try:
+                    alive = not self._pre_ping or \
+                        (yield from self._ping(conn, deadline))
+                except BaseException:
+                    self._unreserve(workload)
+                    raise
+                if alive is None:
+                    # not checked in time, left for other acquires
+                    self._unreserve(workload)
+                    raise self._timeout_error(workload)
+                if not alive:
+                    # broken connection is replaced transparently
+                    self._unreserve(workload)
+                    broken += 1
+                    if broken > retries:
+                        raise psycopg2.OperationalError(
+                            "Pre-ping found {} connections broken "
+                            "in a row".format(broken))
+                    continue
+            elif self._can_grow():
+                left = self._time_left(deadline, workload)
+                self._acquiring += 1
+                self._reserve(workload)
+                try:
+                    conn = yield from self._within(self._open_connection(),
+                                                   left, deadline, workload)
+                except BaseException:
+                    self._unreserve(workload)
+                    raise
+            else:
+                conn = yield from self._wait_free(deadline, priority,
+                                                  workload)
+            break
+        assert not conn.closed, conn
+        assert conn not in self._used, (conn, self._used)
+        self._used.add(conn)
+        now = self._loop.time()
+        self._acquired_at[conn] = now
+        metrics = self._metrics
+        metrics.acquired += 1
+        metrics.acquire_wait.observe(now - started)
+        if workload is not None:
+            self._conn_workload[conn] = workload
+            for share in workload:
+                if share is not None:
+                    share.metrics.acquired += 1
+                    share.metrics.acquire_wait.observe(now - started)
+        if len(self._used) > metrics.peak_used:
+            metrics.peak_used = len(self._used)
+        if self._target_wait is not None:
+            self._window_wait.observe(now - started)
+            if len(self._used) > self._window_peak_used:
+                self._window_peak_used = len(self._used)
+        if task is not None:
+            self._task_conns[task] = conn
+            self._task_refs[conn] = [task, 1]
+        if self._on_acquire is not None:
+            try:
+                yield from self._on_acquire(conn)
+            except BaseException:
+                conn.close()
+                self.release(conn)
+                raise
+        return conn
+
+    def _time_left(self, deadline, workload):
+        # time left until the acquire deadline, checked before a step
+        # of acquire() is started
+        if deadline is None:
+            return None
+        timeout = deadline - self._loop.time()
+        if timeout <= 0:
+            raise self._timeout_error(workload)
+        return timeout
 
     @asyncio.coroutine
-    def _fill_free_pool(self, override_min):
-        # iterate over free connections and remove timeouted ones
-        n, free = 0, len(self._free)
-        while n < free:
-            conn = self._free[-1]
-            if conn.closed:
-                self._free.pop()
-            elif self._recycle > -1 \
-                    and self._loop.time() - conn.last_usage > self._recycle:
-                conn.close()
-                self._free.pop()
-            else:
-                self._free.rotate()
-            n += 1
+    def _within(self, coro, timeout, deadline, workload):
+        # run a step of acquire() limited by the acquire deadline,
+        # *timeout* is the time left got by _time_left()
+        if timeout is None:
+            return (yield from coro)
+        try:
+            return (yield from asyncio.wait_for(coro, timeout,
+                                                loop=self._loop))
+        except asyncio.TimeoutError:
+            if self._loop.time() < deadline:
+                # the step timed out itself, e.g. connecting
+                raise
+            raise self._timeout_error(workload)
 
-        while self.size < self.minsize:
-            self._acquiring += 1
+    def _timeout_error(self, workload):
+        self._metrics.timeouts += 1
+        if workload is not None:
+            for share in workload:
+                if share is not None:
+                    share.metrics.timeouts += 1
+        return PoolTimeoutError("Timeout while waiting for a free connection")
+
+    @asyncio.coroutine
+    def _ping(self, conn, deadline=None):
+        # check a connection taken from the free list, the connection
+        # keeps its slot in self._acquiring while being checked; None
+        # is returned if there is no time left for the check
+        self._acquiring += 1
+        alive = False
+        expired = False
+        try:
+            alive = _socket_alive(conn)
+            # a socket of unknown state is checked by a round trip
+            if alive is None or alive and self._pre_ping_idle is not None \
+                    and self._loop.time() - conn.last_usage >= \
+                    self._pre_ping_idle:
+                timeout = PRE_PING_TIMEOUT
+                if deadline is not None:
+                    timeout = min(timeout, deadline - self._loop.time())
+                    if timeout <= 0:
+                        expired = True
+                        return None
+                self._metrics.pings += 1
+                alive = False
+                cur = yield from conn.cursor(timeout=timeout)
+                try:
+                    yield from cur.execute('SELECT 1')
+                finally:
+                    cur.close()
+                alive = True
+        except (psycopg2.Error, asyncio.TimeoutError, OSError) as exc:
+            logger.warning("Pre-ping of pooled connection failed: %r", exc)
+        finally:
+            self._acquiring -= 1
+            if expired:
+                self._put(conn)
+            elif not alive:
+                self._metrics.ping_failed += 1
+                self._close_connection(conn)
+                self._slot_freed()
+        return alive
+
+    @asyncio.coroutine
+    def _wait_free(self, deadline, priority, workload):
+        # wait in priority order for a released connection or a freed
+        # slot, both are handed over by _put() and _slot_freed() directly
+        if self._max_waiters is not None \
+                and self._waiting >= self._max_waiters:
+            self._metrics.overloaded += 1
+            raise PoolOverloadedError(
+                "Too many coroutines are waiting for a connection")
+        timeout = self._time_left(deadline, workload)
+        if self._budget is not None and not self._budget.remaining \
+                and not self._free and (self._size_limit is None or
+                                        self.size < self._size_limit):
+            # the pool may grow but the shared budget is spent
+            self._budget.request(self)
+        waiter = create_future(self._loop)
+        part = tenant = None
+        if workload is not None:
+            part, tenant = workload
+        self._waiters.append(waiter, priority, self._loop.time(), workload,
+                             tenant)
+        self._waiting += 1
+        if part is not None:
+            part.waiting += 1
+        if tenant is not None:
+            tenant.waiting += 1
+        if self._waiting > self._metrics.peak_waiting:
+            self._metrics.peak_waiting = self._waiting
+        timeout_handle = None
+        if timeout is not None:
+            timeout_handle = self._loop.call_later(timeout,
+                                                   _timeout_waiter, waiter)
+        try:
+            conn = yield from waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() \
+                    and waiter.exception() is None:
+                # cancelled after being woken up, pass the handed
+                # over connection or slot to the next waiter
+                self._acquiring -= 1
+                self._unreserve(workload)
+                conn = waiter.result()
+                if conn is None:
+                    self._slot_freed()
+                else:
+                    self._put(conn)
+            raise
+        except PoolTimeoutError:
+            self._timeout_error(workload)
+            raise
+        finally:
+            self._waiting -= 1
+            if part is not None:
+                part.waiting -= 1
+            if tenant is not None:
+                tenant.waiting -= 1
+                if not tenant.waiting:
+                    # forget tags of cancelled waiters, served ones
+                    # are behind the virtual time anyway
+                    tenant.finish = 0.0
+            if timeout_handle is not None:
+                timeout_handle.cancel()
+        if conn is None:
+            # the slot is reserved for us by _slot_freed()
             try:
-                conn = yield from connect(
-                    self._dsn, loop=self._loop, timeout=self._timeout,
-                    enable_json=self._enable_json,
-                    enable_hstore=self._enable_hstore,
-                    enable_uuid=self._enable_uuid,
-                    echo=self._echo,
-                    **self._conn_kwargs)
-                # raise exception if pool is closing
-                self._free.append(conn)
-                self._cond.notify()
-            finally:
+                left = self._time_left(deadline, workload)
+            except PoolTimeoutError:
                 self._acquiring -= 1
-        if self._free:
+                self._unreserve(workload)
+                self._slot_freed()
+                raise
+            try:
+                return (yield from self._within(self._open_connection(),
+                                                left, deadline, workload))
+            except BaseException:
+                self._unreserve(workload)
+                raise
+        self._acquiring -= 1
+        return conn
+
+    def _put(self, conn):
+        # hand the connection over to the next waiter if any
+        if self._closing:
+            self._close_connection(conn)
+            self._slot_freed()
+            return
+        if self._waiting:
+            waiter, workload = self._waiters.pop(self._loop.time(),
+                                                 self._eligible)
+            if waiter is not None:
+                self._acquiring += 1
+                self._reserve(workload)
+                waiter.set_result(conn)
+                return
+        if self._budget is not None and self._budget.wanted(self) \
+                and self.size > self.minsize:
+            # pass the connection budget on to a starving pool
+            self._close_connection(conn)
             return
+        self._free.append(conn)
 
-        if override_min and self.size < self.maxsize:
+    def _slot_freed(self):
+        # a connection has gone, let the next waiter open a new one
+        if self._closing:
+            waiter = self._close_waiter
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+            return
+        if not self._waiting or not self._can_grow():
+            return
+        waiter, workload = self._waiters.pop(self._loop.time(),
+                                             self._eligible)
+        if waiter is not None:
             self._acquiring += 1
+            self._reserve(workload)
+            waiter.set_result(None)
+
+    def _get_partition(self, name):
+        if self._partitions is None:
+            if name is not None:
+                raise ValueError("Pool has no partitions")
+            return None
+        try:
+            return self._partitions[name]
+        except KeyError:
+            raise ValueError("Unknown pool partition {!r}".format(name))
+
+    def _get_workload(self, partition, tenant):
+        # (partition, tenant) pair the connection is accounted to,
+        # None if neither is used
+        part = self._get_partition(partition)
+        if tenant is not None:
+            tenant = self._get_tenant(tenant)
+        elif part is None:
+            return None
+        return part, tenant
+
+    def _get_tenant(self, name):
+        tenant = self._tenants.get(name)
+        if tenant is None:
+            tenant = self._tenants[name] = _Tenant(
+                name, self._tenant_weights.get(name, 1), self._tenant_limit)
+        recent = self._recent_tenants
+        recent[name] = tenant
+        recent.move_to_end(name)
+        if len(recent) > RECENT_TENANTS:
+            recent.popitem(last=False)
+        return tenant
+
+    def _workload_allows(self, workload):
+        part, tenant = workload
+        if tenant is not None and tenant.limit is not None \
+                and tenant.used >= tenant.limit:
+            return False
+        return part is None or self._partition_allows(part)
+
+    def _partition_allows(self, part):
+        # may the partition take one more connection without eating
+        # into minimums reserved for other partitions
+        if part.used >= part.max:
+            return False
+        if part.used < part.min:
+            return True
+        used = reserved = 0
+        for other in self._partitions.values():
+            used += other.used
+            if other is not part and other.used < other.min:
+                reserved += other.min - other.used
+        return used + reserved < self.maxsize
+
+    def _reserve(self, workload):
+        if workload is not None:
+            for share in workload:
+                if share is not None:
+                    share.used += 1
+
+    def _unreserve(self, workload, wakeup=True):
+        if workload is None:
+            return
+        for share in workload:
+            if share is not None:
+                share.used -= 1
+        # waiters of other workloads may fit into the returned share
+        if wakeup and self._waiting and not self._closing:
+            if self._free:
+                self._put(self._pop_free())
+            else:
+                self._slot_freed()
+
+    def _after_fork(self):
+        # the pool is used in a child process: drop inherited
+        # connections (closing them is safe for the parent, see
+        # Connection._close_forked()) and forget the parent's
+        # acquisitions, the pool is refilled on demand
+        logger.info("Pool is used in a forked process, dropping %d "
+                    "inherited connections",
+                    len(self._free) + len(self._used))
+        self._pid = os.getpid()
+        while self._free:
+            self._close_connection(self._free.popleft())
+        for conn in self._used:
+            self._close_connection(conn)
+            self._terminated.add(conn)
+        self._used.clear()
+        self._acquired_at.clear()
+        self._conn_workload.clear()
+        self._task_conns.clear()
+        self._task_refs.clear()
+        # waiters and connecting coroutines live in the parent only
+        self._waiters.clear()
+        self._waiting = 0
+        self._acquiring = 0
+        self._connecting = asyncio.Semaphore(self._max_connecting,
+                                             loop=self._loop)
+        for share in itertools.chain((self._partitions or {}).values(),
+                                     list(self._tenants.values())):
+            share.used = share.waiting = 0
+        self._window_peak_used = 0
+
+    def _can_grow(self):
+        if self._budget is not None and not self._budget.remaining:
+            return False
+        return self._size_limit is None or self.size < self._size_limit
+
+    @asyncio.coroutine
+    def _fill_free_pool(self, min_idle=0):
+        # open connections up to minsize and up to min_idle free ones
+        self._drop_stale_free()
+        count = max(self.minsize - self.size, min_idle - self.freesize, 0)
+        if self._size_limit is not None:
+            count = min(count, self._size_limit - self.size)
+        if self._budget is not None:
+            count = min(count, self._budget.remaining)
+        if count <= 0:
+            return
+        if self._circuit_state != 'closed':
+            # don't hammer a recovering server, a single probe at most
+            if not self._circuit_allows():
+                return
+            count = 1
+        self._acquiring += count
+        results = yield from asyncio.gather(
+            *[self._open_free_connection() for _ in range(count)],
+            loop=self._loop, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    def _pop_free(self):
+        # released connections are appended to the right, FIFO reuses
+        # the one released longest time ago, LIFO the latest one
+        if self._lifo:
+            return self._free.pop()
+        return self._free.popleft()
+
+    def _drop_stale_free(self):
+        # drop closed and timeouted connections from the end of the
+        # free list the next connection is acquired from
+        now = self._loop.time()
+        while self._free:
+            conn = self._free[-1] if self._lifo else self._free[0]
+            if conn.closed:
+                self._forget_connection()
+            elif self._recycle > -1 \
+                    and now - conn.last_usage > self._recycle:
+                self._close_connection(conn)
+                self._metrics.recycled += 1
+            elif self._expired(conn, now):
+                self._close_connection(conn)
+                self._metrics.expired += 1
+            else:
+                break
+            self._pop_free()
+            self._slot_freed()
+
+    def _expired(self, conn, now):
+        expires_at = self._expires_at.get(conn)
+        return expires_at is not None and now >= expires_at
+
+    def _start_maintenance(self):
+        if self._max_idle is None and self._max_lifetime is None \
+                and not self._min_idle and self._target_wait is None:
+            return
+        if self._maintenance_task is None and not self._closing:
+            self._maintenance_task = ensure_future(
+                self._maintenance(self._maintenance_interval()),
+                loop=self._loop)
+
+    def _maintenance_interval(self):
+        limits = [limit / 4 for limit in (self._max_idle, self._max_lifetime)
+                  if limit is not None]
+        return min(limits + [MAINTENANCE_INTERVAL])
+
+    @asyncio.coroutine
+    def _maintenance(self, interval):
+        delay = interval
+        while True:
+            yield from asyncio.sleep(delay, loop=self._loop)
             try:
+                yield from self._maintain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                # back off exponentially while the server is unavailable
+                delay = min(delay * 2, MAINTENANCE_BACKOFF_MAX)
+                logger.warning("Pool maintenance failed, retrying in "
+                               "%.1f seconds: %r", delay, exc)
+            else:
+                delay = interval
+
+    @asyncio.coroutine
+    def _maintain(self):
+        # close free connections which are expired or idle for too
+        # long, idle ones are closed only down to minsize and min_idle
+        if self._pid != os.getpid():
+            self._after_fork()
+        if self._target_wait is not None:
+            self._adapt_size()
+        now = self._loop.time()
+        metrics = self._metrics
+        for conn in list(self._free):
+            if conn.closed:
+                self._forget_connection()
+            elif self._expired(conn, now):
+                self._close_connection(conn)
+                metrics.expired += 1
+            elif self._max_idle is not None \
+                    and now - conn.last_usage > self._max_idle \
+                    and self.size > self.minsize \
+                    and self.freesize > self._min_idle:
+                self._close_connection(conn)
+                metrics.idle_closed += 1
+            else:
+                continue
+            self._free.remove(conn)
+            self._slot_freed()
+        # reopen expired connections in background, not on acquire
+        if not self._closing:
+            yield from self._fill_free_pool(self._min_idle)
+
+    def _adapt_size(self):
+        # grow the size limit fast while waits exceed the target, shrink
+        # it slowly while some connections are not used at all
+        wait = self._window_wait.quantile(ADAPTIVE_QUANTILE)
+        peak_used = self._window_peak_used
+        self._window_wait.reset()
+        self._window_peak_used = len(self._used)
+        limit = self._size_limit
+        if wait is not None and wait > self._target_wait \
+                or wait is None and self._waiting:
+            new_limit = min(limit * 2, self.maxsize)
+            if new_limit == limit:
+                return
+            self._size_limit = new_limit
+            self._metrics.grown += 1
+            if wait is None:
+                logger.info("Growing pool size limit from %d to %d, "
+                            "%d coroutines are waiting", limit, new_limit,
+                            self._waiting)
+            else:
+                logger.info("Growing pool size limit from %d to %d, "
+                            "p95 acquire wait %.3f exceeds %.3f seconds",
+                            limit, new_limit, wait, self._target_wait)
+            # let waiters open connections in the new slots
+            for _ in range(new_limit - limit):
+                self._slot_freed()
+        elif not self._waiting and peak_used + self._min_idle < limit \
+                and limit > max(self.minsize, 1):
+            self._size_limit = limit - 1
+            self._metrics.shrunk += 1
+            logger.info("Shrinking pool size limit from %d to %d, "
+                        "at most %d connections were used",
+                        limit, limit - 1, peak_used)
+            # least recently used connections are closed first
+            while self.size > self._size_limit and self._free:
+                self._close_connection(self._free.popleft())
+
+    @asyncio.coroutine
+    def _open_free_connection(self):
+        conn = yield from self._open_connection()
+        self._put(conn)
+
+    @asyncio.coroutine
+    def _open_connection(self):
+        # the caller reserves a slot in self._acquiring, it is released
+        # here and the caller accounts the returned connection itself
+        conn = None
+        probe = False
+        # the server accepted the connection, a failure of the
+        # on_connect hook doesn't count for the circuit breaker
+        connected = False
+        # a token of the budget shared with other pools, owned by the
+        # connection once it is opened
+        charged = False
+        try:
+            if self._budget is not None:
+                yield from self._budget.acquire(self._loop)
+                charged = True
+            with (yield from self._connecting):
+                if not self._circuit_allows():
+                    raise PoolCircuitOpenError(
+                        "Connecting is suspended after {} failures".format(
+                            self._connect_failures))
+                if self._circuit_state == 'half-open':
+                    probe = self._circuit_probing = True
                 conn = yield from connect(
                     self._dsn, loop=self._loop, timeout=self._timeout,
                     enable_json=self._enable_json,
@@ -225,42 +1316,186 @@ class Pool(asyncio.AbstractServer):
                     enable_uuid=self._enable_uuid,
                     echo=self._echo,
                     **self._conn_kwargs)
-                # raise exception if pool is closing
-                self._free.append(conn)
-                self._cond.notify()
-            finally:
-                self._acquiring -= 1
+                connected = True
+                charged = False
+                self._metrics.created += 1
+                if self._max_lifetime is not None:
+                    self._expires_at[conn] = (
+                        self._loop.time() + self._max_lifetime *
+                        (1 - LIFETIME_JITTER * random.random()))
+                if self._on_connect is not None:
+                    try:
+                        yield from self._on_connect(conn)
+                    except BaseException:
+                        self._close_connection(conn)
+                        conn = None
+                        raise
+        except PoolCircuitOpenError:
+            raise
+        except asyncio.CancelledError:
+            if connected:
+                self._connect_succeeded()
+            elif probe:
+                self._circuit_probing = False
+            raise
+        except Exception:
+            if connected:
+                self._connect_succeeded()
+            else:
+                self._metrics.connect_errors += 1
+                self._connect_failed(probe)
+            raise
+        else:
+            self._connect_succeeded()
+        finally:
+            if charged:
+                self._budget.release()
+            self._acquiring -= 1
+            if conn is None:
+                self._slot_freed()
+        if self._closing:
+            self._close_connection(conn)
+            self._slot_freed()
+            raise RuntimeError("Cannot acquire connection after closing pool")
+        return conn
 
-    @asyncio.coroutine
-    def _wakeup(self):
-        with (yield from self._cond):
-            self._cond.notify()
+    def _circuit_allows(self):
+        # may a new connection be opened now
+        if self._circuit_state == 'open':
+            if self._loop.time() < self._circuit_retry_at:
+                return False
+            self._circuit_state = 'half-open'
+        if self._circuit_state == 'half-open':
+            return not self._circuit_probing
+        return True
+
+    def _connect_failed(self, probe):
+        self._connect_failures += 1
+        if self._breaker_threshold is None:
+            return
+        if probe:
+            self._circuit_probing = False
+            self._circuit_timeout = min(self._circuit_timeout * 2,
+                                        BREAKER_TIMEOUT_MAX)
+            self._open_circuit()
+        elif self._circuit_state == 'closed' \
+                and self._connect_failures >= self._breaker_threshold:
+            self._open_circuit()
+
+    def _open_circuit(self):
+        # jitter spreads probes of many pools and processes in time
+        timeout = self._circuit_timeout * (1 - 0.1 * random.random())
+        self._circuit_state = 'open'
+        self._circuit_retry_at = self._loop.time() + timeout
+        self._metrics.circuit_opened += 1
+        logger.warning("Opening pool circuit breaker after %d connection "
+                       "failures, next attempt in %.1f seconds",
+                       self._connect_failures, timeout)
+
+    def _connect_succeeded(self):
+        self._connect_failures = 0
+        if self._circuit_state != 'closed':
+            logger.info("Pool circuit breaker is closed")
+            self._circuit_state = 'closed'
+            self._circuit_probing = False
+            self._circuit_timeout = self._breaker_timeout
+
+    def _close_connection(self, conn):
+        self._forget_connection()
+        return conn.close()
+
+    def _forget_connection(self):
+        # a pool connection is closed
+        self._metrics.closed += 1
+        if self._budget is not None:
+            self._budget.release()
+
+    def _budget_released(self):
+        # called in the pool loop when a connection of any pool sharing
+        # the budget is closed
+        if self._waiting and not self._closing:
+            self._slot_freed()
+
+    def _shed_free(self):
+        # called in the pool loop when another pool sharing the budget
+        # waits for it, give up the least recently used free connection
+        if self._free and self.size > self.minsize and not self._closing:
+            self._close_connection(self._free.popleft())
 
     def release(self, conn):
         """Release free connection back to the connection pool.
         """
+        ref = self._task_refs.get(conn)
+        if ref is not None:
+            ref[1] -= 1
+            if ref[1]:
+                # still used by an outer acquire of the task
+                fut = create_future(self._loop)
+                fut.set_result(None)
+                return fut
+            del self._task_refs[conn]
+            if self._task_conns.get(ref[0]) is conn:
+                del self._task_conns[ref[0]]
+        acquired_at = self._acquired_at.pop(conn, None)
+        if acquired_at is not None:
+            hold_time = self._loop.time() - acquired_at
+            self._metrics.hold_time.observe(hold_time)
+            workload = self._conn_workload.get(conn)
+            if workload is not None:
+                for share in workload:
+                    if share is not None:
+                        share.metrics.hold_time.observe(hold_time)
+            if self._on_release is not None and not conn.closed:
+                return ensure_future(self._release_after_hook(conn),
+                                     loop=self._loop)
+        self._release(conn)
         fut = create_future(self._loop)
         fut.set_result(None)
+        return fut
+
+    @asyncio.coroutine
+    def _release_after_hook(self, conn):
+        # the connection stays in self._used while the hook is running
+        ok = False
+        try:
+            yield from self._on_release(conn)
+            ok = True
+        except Exception:
+            logger.exception("on_release callback failed, "
+                             "closing connection")
+        finally:
+            if not ok:
+                conn.close()
+            self._release(conn)
+
+    def _release(self, conn):
         if conn in self._terminated:
             assert conn.closed, conn
             self._terminated.remove(conn)
-            return fut
+            return
         assert conn in self._used, (conn, self._used)
         self._used.remove(conn)
-        if not conn.closed:
+        # waiters are woken by handing the connection or its slot over
+        # below
+        self._unreserve(self._conn_workload.pop(conn, None), wakeup=False)
+        if conn.closed:
+            self._forget_connection()
+        else:
             tran_status = conn._conn.get_transaction_status()
             if tran_status != TRANSACTION_STATUS_IDLE:
                 logger.warning(
                     "Invalid transaction status on released connection: %d",
                     tran_status)
-                conn.close()
-                return fut
-            if self._closing:
-                conn.close()
+                self._close_connection(conn)
+            elif self._closing:
+                self._close_connection(conn)
+            elif self._expired(conn, self._loop.time()):
+                self._close_connection(conn)
+                self._metrics.expired += 1
             else:
-                self._free.append(conn)
-            fut = ensure_future(self._wakeup(), loop=self._loop)
-        return fut
+                self._put(conn)
+                return
+        self._slot_freed()
 
     @asyncio.coroutine
     def cursor(self, name=None, cursor_factory=None,
@@ -272,6 +1507,45 @@ class Pool(asyncio.AbstractServer):
                                      timeout=timeout)
         return _PoolCursorContextManager(self, conn, cur)
 
+    @asyncio.coroutine
+    def execute(self, operation, parameters=None, *, timeout=None):
+        """Run a query on a pool connection, return the status message."""
+        return (yield from self._query(operation, parameters, timeout,
+                                       'execute', _status))
+
+    @asyncio.coroutine
+    def fetch(self, operation, parameters=None, *, timeout=None):
+        """Run a query on a pool connection, return all result rows."""
+        return (yield from self._query(operation, parameters, timeout,
+                                       'fetch', _all_rows))
+
+    @asyncio.coroutine
+    def fetchrow(self, operation, parameters=None, *, timeout=None):
+        """Run a query on a pool connection, return the first row."""
+        return (yield from self._query(operation, parameters, timeout,
+                                       'fetchrow', _first_row))
+
+    @asyncio.coroutine
+    def fetchval(self, operation, parameters=None, *, column=0,
+                 timeout=None):
+        """Run a query on a pool connection, return a single value."""
+        row = yield from self._query(operation, parameters, timeout,
+                                     'fetchval', _first_row)
+        if row is None:
+            return None
+        return row[column]
+
+    @asyncio.coroutine
+    def _query(self, operation, parameters, timeout, func_name, result):
+        # acquire, run and release without context manager objects,
+        # *timeout* limits the query only like in Cursor.execute()
+        conn = yield from self._acquire()
+        try:
+            return (yield from conn._query(operation, parameters, timeout,
+                                           func_name, result))
+        finally:
+            self.release(conn)
+
     def __enter__(self):
         raise RuntimeError(
             '"yield from" should be used as context manager expression')
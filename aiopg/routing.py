@@ -0,0 +1,350 @@
+import asyncio
+
+import psycopg2
+
+from .connection import TIMEOUT
+from .log import logger
+from .pool import PoolTimeoutError, _create_pool
+from .utils import (PY_35, _PoolContextManager, _PoolAcquireContextManager,
+                    _PoolConnectionContextManager, ensure_future)
+
+
+__all__ = ('create_routing_pool', 'RoutingPool')
+
+# seconds a replica which failed to give a connection is tried after
+# the other servers only, reads don't keep waiting for a hung server
+REPLICA_RETRY_DELAY = 5.0
+
+
+def create_routing_pool(dsn=None, *, replicas=(), fallback=True, loop=None,
+                        timeout=TIMEOUT, **kwargs):
+    """A coroutine creating a pool of a primary server and its replicas.
+
+    *replicas* is a sequence of replica DSNs or dicts of connection
+    parameters overriding the primary ones. The rest of parameters are
+    passed to create_pool() for every server.
+    """
+    coro = _create_routing_pool(dsn, replicas=replicas, fallback=fallback,
+                                loop=loop, timeout=timeout, **kwargs)
+    return _PoolContextManager(coro)
+
+
+@asyncio.coroutine
+def _create_routing_pool(dsn=None, *, replicas=(), fallback=True, loop=None,
+                         timeout=TIMEOUT, **kwargs):
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    pools = []
+    try:
+        pools.append((yield from _create_pool(dsn, loop=loop, timeout=timeout,
+                                              **kwargs)))
+        for replica in replicas:
+            if isinstance(replica, dict):
+                params = dict(kwargs, **replica)
+                replica_dsn = params.pop('dsn', dsn)
+            else:
+                params = kwargs
+                replica_dsn = replica
+            # a replica being down doesn't prevent starting, acquires
+            # fall back to other servers
+            pools.append((yield from _create_pool(
+                replica_dsn, loop=loop, timeout=timeout, strict=False,
+                **params)))
+    except BaseException:
+        for pool in pools:
+            pool.close()
+        for pool in pools:
+            yield from pool.wait_closed()
+        raise
+    return RoutingPool(pools[0], pools[1:], loop=loop, fallback=fallback)
+
+
+class RoutingPool(asyncio.AbstractServer):
+    """Read/write splitting on top of a primary and replica pools.
+
+    Read-only acquires are balanced over the replicas, the rest go to
+    the primary.
+    """
+
+    def __init__(self, primary, replicas, *, loop, fallback=True):
+        self._primary = primary
+        self._replicas = list(replicas)
+        self._loop = loop
+        self._fallback = fallback
+        # connection -> pool it was acquired from
+        self._owners = {}
+        # primary connections serving read-only acquires
+        self._readonly = set()
+        # replica pool -> time it is preferred again after a failure
+        self._retry_at = {}
+        # a replica to start looking from, rotates to spread ties
+        self._next = 0
+        self._routed = {'primary': 0, 'replicas': 0, 'fallbacks': 0}
+
+    @property
+    def primary(self):
+        return self._primary
+
+    @property
+    def replicas(self):
+        return list(self._replicas)
+
+    @property
+    def fallback(self):
+        return self._fallback
+
+    @property
+    def timeout(self):
+        return self._primary.timeout
+
+    @property
+    def minsize(self):
+        return self._primary.minsize
+
+    @property
+    def maxsize(self):
+        return self._primary.maxsize
+
+    @property
+    def size(self):
+        return sum(pool.size for pool in self._pools())
+
+    @property
+    def freesize(self):
+        return sum(pool.freesize for pool in self._pools())
+
+    @property
+    def metrics(self):
+        """Live metrics of the primary pool."""
+        return self._primary.metrics
+
+    @property
+    def circuit_state(self):
+        """Circuit breaker state of the primary pool."""
+        return self._primary.circuit_state
+
+    @property
+    def closed(self):
+        return all(pool.closed for pool in self._pools())
+
+    def stats(self):
+        """Return a snapshot of statistics of all the pools as a dict."""
+        stats = dict(self._routed)
+        stats.update(size=self.size,
+                     freesize=self.freesize,
+                     primary_stats=self._primary.stats(),
+                     replica_stats=[pool.stats() for pool in self._replicas])
+        return stats
+
+    def _pools(self):
+        return [self._primary] + self._replicas
+
+    def close(self):
+        """Close the primary and replica pools."""
+        for pool in self._pools():
+            pool.close()
+
+    def terminate(self):
+        """Terminate the primary and replica pools."""
+        for pool in self._pools():
+            pool.terminate()
+
+    @asyncio.coroutine
+    def wait_closed(self):
+        """Wait for closing all connections of the pools."""
+        for pool in self._pools():
+            yield from pool.wait_closed()
+
+    @asyncio.coroutine
+    def drain(self, timeout=None):
+        """Close the pools gracefully, see Pool.drain()."""
+        yield from asyncio.gather(*[pool.drain(timeout)
+                                    for pool in self._pools()],
+                                  loop=self._loop)
+
+    def acquire(self, *, readonly=False, timeout=None, priority=0,
+                partition=None, tenant=None):
+        """Acquire a connection of the primary or, if *readonly*,
+        a replica pool.
+
+        The rest of parameters are the same as for Pool.acquire().
+        """
+        coro = self._acquire(readonly, timeout, priority, partition, tenant)
+        return _PoolAcquireContextManager(coro, self)
+
+    @asyncio.coroutine
+    def _acquire(self, readonly=False, timeout=None, priority=0,
+                 partition=None, tenant=None):
+        pools = self._route(readonly)
+        for i, pool in enumerate(pools):
+            try:
+                conn = yield from pool._acquire(timeout, priority,
+                                                partition, tenant)
+            except PoolTimeoutError:
+                # the deadline of the caller, not a server failure
+                raise
+            except (psycopg2.OperationalError, asyncio.TimeoutError,
+                    OSError) as exc:
+                # PoolCircuitOpenError and connect timeouts of a hung
+                # server included, try the next server
+                if pool is not self._primary:
+                    self._retry_at[pool] = \
+                        self._loop.time() + REPLICA_RETRY_DELAY
+                if i == len(pools) - 1:
+                    raise
+                logger.warning("Server is unavailable, "
+                               "trying the next one: %r", exc)
+                continue
+            self._retry_at.pop(pool, None)
+            self._owners[conn] = pool
+            if pool is not self._primary:
+                self._routed['replicas'] += 1
+            elif not readonly:
+                self._routed['primary'] += 1
+            else:
+                self._routed['fallbacks'] += 1
+                ref = pool._task_refs.get(conn)
+                if ref is None or ref[1] == 1:
+                    # not shared with an outer acquire of the task
+                    yield from self._set_readonly(conn)
+            return conn
+
+    @asyncio.coroutine
+    def _set_readonly(self, conn):
+        # writes fail on the primary like they would on a replica
+        try:
+            yield from conn.execute(
+                'SET default_transaction_read_only = on')
+        except BaseException:
+            conn.close()
+            self.release(conn)
+            raise
+        self._readonly.add(conn)
+
+    def _route(self, readonly):
+        # the candidates in order of preference
+        if not readonly:
+            return [self._primary]
+        count = len(self._replicas)
+        start = self._next
+        self._next = (start + 1) % count if count else 0
+        replicas = [pool for pool in
+                    self._replicas[start:] + self._replicas[:start]
+                    if not pool._closing]
+        # the least loaded replica first, replicas with an open
+        # breaker last, the primary serves reads if there is no replica;
+        # replicas failed recently are tried after all the others
+        replicas.sort(key=self._load)
+        now = self._loop.time()
+        failed = [pool for pool in replicas
+                  if self._retry_at.get(pool, 0) > now]
+        candidates = [pool for pool in replicas if pool not in failed]
+        if self._fallback or not replicas:
+            candidates.append(self._primary)
+        return candidates + failed
+
+    @staticmethod
+    def _load(pool):
+        busy = len(pool._used) + pool._waiting
+        if pool.maxsize:
+            busy /= pool.maxsize
+        return (pool.circuit_state == 'open', busy)
+
+    def release(self, conn):
+        """Release a connection back to its pool."""
+        pool = self._owners.get(conn)
+        assert pool is not None, conn
+        ref = pool._task_refs.get(conn)
+        if ref is not None and ref[1] > 1:
+            # still used by an outer acquire of the task
+            return pool.release(conn)
+        del self._owners[conn]
+        if conn in self._readonly:
+            self._readonly.remove(conn)
+            return ensure_future(self._release_readonly(pool, conn),
+                                 loop=self._loop)
+        return pool.release(conn)
+
+    @asyncio.coroutine
+    def _release_readonly(self, pool, conn):
+        # the connection is writable again before other acquires get it
+        ok = False
+        try:
+            if not conn.closed:
+                yield from conn.execute('RESET default_transaction_read_only')
+                ok = True
+        except Exception as exc:
+            logger.warning("Cannot reset read-only session, "
+                           "closing connection: %r", exc)
+        finally:
+            if not ok:
+                conn.close()
+            yield from pool.release(conn)
+
+    @asyncio.coroutine
+    def execute(self, operation, parameters=None, *, readonly=False,
+                timeout=None):
+        """Run a query, return the status message."""
+        conn = yield from self._acquire(readonly)
+        try:
+            return (yield from conn.execute(operation, parameters,
+                                            timeout=timeout))
+        finally:
+            self.release(conn)
+
+    @asyncio.coroutine
+    def fetch(self, operation, parameters=None, *, readonly=False,
+              timeout=None):
+        """Run a query, return all result rows."""
+        conn = yield from self._acquire(readonly)
+        try:
+            return (yield from conn.fetch(operation, parameters,
+                                          timeout=timeout))
+        finally:
+            self.release(conn)
+
+    @asyncio.coroutine
+    def fetchrow(self, operation, parameters=None, *, readonly=False,
+                 timeout=None):
+        """Run a query, return the first row."""
+        conn = yield from self._acquire(readonly)
+        try:
+            return (yield from conn.fetchrow(operation, parameters,
+                                             timeout=timeout))
+        finally:
+            self.release(conn)
+
+    @asyncio.coroutine
+    def fetchval(self, operation, parameters=None, *, column=0,
+                 readonly=False, timeout=None):
+        """Run a query, return a single value."""
+        conn = yield from self._acquire(readonly)
+        try:
+            return (yield from conn.fetchval(operation, parameters,
+                                             column=column, timeout=timeout))
+        finally:
+            self.release(conn)
+
+    def __enter__(self):
+        raise RuntimeError(
+            '"yield from" should be used as context manager expression')
+
+    def __exit__(self, *args):
+        # This must exist because __enter__ exists, even though that
+        # always raises; that's how the with-statement works.
+        pass  # pragma: nocover
+
+    def __iter__(self):
+        # This is not a coroutine, see Pool.__iter__()
+        conn = yield from self.acquire()
+        return _PoolConnectionContextManager(self, conn)
+
+    if PY_35:  # pragma: no branch
+        @asyncio.coroutine
+        def __aenter__(self):
+            return self
+
+        @asyncio.coroutine
+        def __aexit__(self, exc_type, exc_val, exc_tb):
+            self.close()
+            yield from self.wait_closed()
@@ -6,6 +6,7 @@ import aiopg
 from .connection import SAConnection
 from .exc import InvalidRequestError
 from ..connection import TIMEOUT
+from ..routing import _create_routing_pool, RoutingPool
 from ..utils import PY_35, _PoolContextManager, _PoolAcquireContextManager
 
 try:
@@ -45,29 +46,38 @@ _dialect._has_native_hstore = True
 
 def create_engine(dsn=None, *, minsize=1, maxsize=10, loop=None,
                   dialect=_dialect, timeout=TIMEOUT, pool_recycle=-1,
-                  **kwargs):
+                  replicas=None, **kwargs):
     """A coroutine for Engine creation.
 
     Returns Engine instance with embedded connection pool.
 
     The pool has *minsize* opened connections to PostgreSQL server.
+
+    If *replicas* are given the engine routes read-only acquires to
+    them, see aiopg.create_routing_pool().
     """
 
     coro = _create_engine(dsn=dsn, minsize=minsize, maxsize=maxsize,
                           loop=loop, dialect=dialect, timeout=timeout,
-                          pool_recycle=pool_recycle, **kwargs)
+                          pool_recycle=pool_recycle, replicas=replicas,
+                          **kwargs)
     return _EngineContextManager(coro)
 
 
 @asyncio.coroutine
 def _create_engine(dsn=None, *, minsize=1, maxsize=10, loop=None,
                    dialect=_dialect, timeout=TIMEOUT, pool_recycle=-1,
-                   **kwargs):
+                   replicas=None, **kwargs):
     if loop is None:
         loop = asyncio.get_event_loop()
-    pool = yield from aiopg.create_pool(dsn, minsize=minsize, maxsize=maxsize,
-                                        loop=loop, timeout=timeout,
-                                        pool_recycle=pool_recycle, **kwargs)
+    if replicas:
+        pool = yield from _create_routing_pool(
+            dsn, replicas=replicas, minsize=minsize, maxsize=maxsize,
+            loop=loop, timeout=timeout, pool_recycle=pool_recycle, **kwargs)
+    else:
+        pool = yield from aiopg.create_pool(
+            dsn, minsize=minsize, maxsize=maxsize, loop=loop,
+            timeout=timeout, pool_recycle=pool_recycle, **kwargs)
     conn = yield from pool.acquire()
     try:
         real_dsn = conn.dsn
@@ -134,6 +144,20 @@ class Engine:
     def closed(self):
         return self._pool.closed
 
+    @property
+    def metrics(self):
+        """Live metrics of the engine pool."""
+        return self._pool.metrics
+
+    def stats(self):
+        """Return a snapshot of engine pool statistics as a dict."""
+        return self._pool.stats()
+
+    @property
+    def circuit_state(self):
+        """Circuit breaker state of the engine pool."""
+        return self._pool.circuit_state
+
     def close(self):
         """Close engine.
 
@@ -155,14 +179,30 @@ class Engine:
         """Wait for closing all engine's connections."""
         yield from self._pool.wait_closed()
 
-    def acquire(self):
-        """Get a connection from pool."""
-        coro = self._acquire()
+    @asyncio.coroutine
+    def drain(self, timeout=None):
+        """Close engine gracefully, see Pool.drain()."""
+        yield from self._pool.drain(timeout)
+
+    def acquire(self, *, timeout=None, priority=0, partition=None,
+                tenant=None, readonly=False):
+        """Get a connection from pool.
+
+        *readonly* connections come from replicas of an engine created
+        with *replicas*, from the single pool otherwise.
+        """
+        coro = self._acquire(timeout, priority, partition, tenant, readonly)
         return _EngineAcquireContextManager(coro, self)
 
     @asyncio.coroutine
-    def _acquire(self):
-        raw = yield from self._pool.acquire()
+    def _acquire(self, timeout=None, priority=0, partition=None,
+                 tenant=None, readonly=False):
+        kwargs = {}
+        if isinstance(self._pool, RoutingPool):
+            kwargs['readonly'] = readonly
+        raw = yield from self._pool.acquire(timeout=timeout, priority=priority,
+                                            partition=partition, tenant=tenant,
+                                            **kwargs)
         conn = SAConnection(raw, self)
         return conn
 
@@ -0,0 +1,156 @@
+import bisect
+
+
+#: Default histogram bucket upper bounds in seconds.
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Fixed buckets histogram.
+
+    Recording a value is a single bisect and a couple of additions so
+    the histogram can be left enabled in production.
+    """
+
+    __slots__ = ('_bounds', '_counts', '_count', '_sum', '_max')
+
+    def __init__(self, bounds=TIME_BUCKETS):
+        self._bounds = tuple(sorted(bounds))
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+
+    @property
+    def bounds(self):
+        return self._bounds
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    @property
+    def max(self):
+        return self._max
+
+    def observe(self, value):
+        """Record a single value."""
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self._count += 1
+        self._sum += value
+        if value > self._max:
+            self._max = value
+
+    def quantile(self, q):
+        """Return an upper estimate of the *q* quantile (0 <= q <= 1).
+
+        The estimate is the upper bound of the bucket the quantile
+        falls into, the maximal observed value for the last bucket.
+        ``None`` is returned if nothing was observed yet.
+        """
+        if not self._count:
+            return None
+        rank = q * self._count
+        seen = 0
+        for bound, count in zip(self._bounds, self._counts):
+            seen += count
+            if seen >= rank and seen:
+                return min(bound, self._max)
+        return self._max
+
+    def reset(self):
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+
+    def snapshot(self):
+        """Return the histogram state as a dict.
+
+        ``buckets`` is a list of ``(upper_bound, count)`` pairs, the
+        last bound is ``float('inf')``.
+        """
+        bounds = self._bounds + (float('inf'),)
+        return {'count': self._count,
+                'sum': self._sum,
+                'max': self._max,
+                'buckets': list(zip(bounds, self._counts))}
+
+    def __repr__(self):
+        return '<Histogram count={} sum={:.6f} max={:.6f}>'.format(
+            self._count, self._sum, self._max)
+
+
+class WorkloadMetrics:
+    """Live counters and histograms of a part of pool workload."""
+
+    __slots__ = ('acquire_wait', 'hold_time', 'acquired', 'timeouts')
+
+    def __init__(self):
+        self.acquire_wait = Histogram()
+        self.hold_time = Histogram()
+        self.acquired = 0
+        self.timeouts = 0
+
+    def snapshot(self):
+        return {'acquired': self.acquired,
+                'timeouts': self.timeouts,
+                'acquire_wait': self.acquire_wait.snapshot(),
+                'hold_time': self.hold_time.snapshot()}
+
+
+class PoolMetrics:
+    """Live counters and histograms of a connection pool."""
+
+    __slots__ = ('acquire_wait', 'hold_time', 'acquired', 'created',
+                 'closed', 'recycled', 'expired', 'idle_closed',
+                 'connect_errors', 'circuit_opened', 'pings', 'ping_failed',
+                 'timeouts', 'overloaded', 'shared', 'grown', 'shrunk',
+                 'peak_used', 'peak_waiting')
+
+    def __init__(self):
+        self.acquire_wait = Histogram()
+        self.hold_time = Histogram()
+        self.acquired = 0
+        self.created = 0
+        self.closed = 0
+        self.recycled = 0
+        self.expired = 0
+        self.idle_closed = 0
+        self.connect_errors = 0
+        self.circuit_opened = 0
+        self.pings = 0
+        self.ping_failed = 0
+        self.timeouts = 0
+        self.overloaded = 0
+        self.shared = 0
+        self.grown = 0
+        self.shrunk = 0
+        self.peak_used = 0
+        self.peak_waiting = 0
+
+    def snapshot(self):
+        return {'acquired': self.acquired,
+                'created': self.created,
+                'closed': self.closed,
+                'recycled': self.recycled,
+                'expired': self.expired,
+                'idle_closed': self.idle_closed,
+                'connect_errors': self.connect_errors,
+                'circuit_opened': self.circuit_opened,
+                'pings': self.pings,
+                'ping_failed': self.ping_failed,
+                'timeouts': self.timeouts,
+                'overloaded': self.overloaded,
+                'shared': self.shared,
+                'grown': self.grown,
+                'shrunk': self.shrunk,
+                'peak_used': self.peak_used,
+                'peak_waiting': self.peak_waiting,
+                'acquire_wait': self.acquire_wait.snapshot(),
+                'hold_time': self.hold_time.snapshot()}
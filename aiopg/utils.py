@@ -62,13 +62,15 @@ class _ContextManager(base):
     def __next__(self):
         return self.send(None)
 
-    @asyncio.coroutine
     def __iter__(self):
-        resp = yield from self._coro
-        return resp
+        # hand the wrapped generator straight to ``yield from``,
+        # this saves an extra generator frame on every resumption
+        return self._coro
 
     if PY_35:
         def __await__(self):
+            # the wrapped generator is flagged as a coroutine
+            # and cannot be returned from __await__ as is
             resp = yield from self._coro
             return resp
 
@@ -0,0 +1,117 @@
+"""Measure per-query overhead of aiopg hot paths.
+
+Runs a stream of trivial ``SELECT 1`` statements so that the numbers
+are dominated by the client side (cursor creation, polling, timeouts,
+pool checkout) rather than by the server.
+
+Usage::
+
+    python benchmarks/queries.py --dsn 'dbname=aiopg user=aiopg host=...'
+
+"""
+import argparse
+import asyncio
+import time
+
+import aiopg
+import aiopg.sa
+
+
+async def bench_connection(dsn, queries, concurrency, loop):
+    conns = [await aiopg.connect(dsn, loop=loop) for _ in range(concurrency)]
+
+    async def worker(conn, n):
+        for _ in range(n):
+            async with conn.cursor() as cur:
+                await cur.execute('SELECT 1')
+                await cur.fetchone()
+
+    try:
+        return await _run(worker, conns, queries, loop)
+    finally:
+        for conn in conns:
+            conn.close()
+
+
+async def bench_pool(dsn, queries, concurrency, loop):
+    async with aiopg.create_pool(dsn, minsize=concurrency,
+                                 maxsize=concurrency, loop=loop) as pool:
+
+        async def worker(_, n):
+            for _ in range(n):
+                async with pool.acquire() as conn:
+                    async with conn.cursor() as cur:
+                        await cur.execute('SELECT 1')
+                        await cur.fetchone()
+
+        return await _run(worker, [None] * concurrency, queries, loop)
+
+
+async def bench_pool_fetch(dsn, queries, concurrency, loop):
+    async with aiopg.create_pool(dsn, minsize=concurrency,
+                                 maxsize=concurrency, loop=loop) as pool:
+
+        async def worker(_, n):
+            for _ in range(n):
+                await pool.fetchval('SELECT 1')
+
+        return await _run(worker, [None] * concurrency, queries, loop)
+
+
+async def bench_sa(dsn, queries, concurrency, loop):
+    async with aiopg.sa.create_engine(dsn, minsize=concurrency,
+                                      maxsize=concurrency,
+                                      loop=loop) as engine:
+
+        async def worker(_, n):
+            for _ in range(n):
+                async with engine.acquire() as conn:
+                    await conn.scalar('SELECT 1')
+
+        return await _run(worker, [None] * concurrency, queries, loop)
+
+
+async def _run(worker, targets, queries, loop):
+    per_worker = queries // len(targets)
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(target, per_worker) for target in targets],
+                         loop=loop)
+    elapsed = time.perf_counter() - start
+    return per_worker * len(targets), elapsed
+
+
+BENCHMARKS = {
+    'connection': bench_connection,
+    'pool': bench_pool,
+    'pool_fetch': bench_pool_fetch,
+    'sa': bench_sa,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dsn', required=True)
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help='one of: ' + ', '.join(sorted(BENCHMARKS)))
+    args = parser.parse_args()
+    names = args.benchmarks or sorted(BENCHMARKS)
+
+    loop = asyncio.get_event_loop()
+    for name in names:
+        best = None
+        for _ in range(args.repeat):
+            done, elapsed = loop.run_until_complete(
+                BENCHMARKS[name](args.dsn, args.queries,
+                                 args.concurrency, loop))
+            if best is None or elapsed < best[1]:
+                best = done, elapsed
+        done, elapsed = best
+        print('{:<12} {:>8} queries  {:>10.0f} q/s  {:>8.1f} us/query'.format(
+            name, done, done / elapsed, elapsed / done * 1e6))
+
+
+if __name__ == '__main__':
+    main()
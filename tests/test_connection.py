@@ -1,6 +1,8 @@
 import asyncio
 import aiopg
+import datetime
 import gc
+import os
 import psycopg2
 import psycopg2.extras
 import psycopg2.extensions
@@ -9,7 +11,7 @@ import socket
 import time
 import sys
 
-from aiopg.connection import Connection, TIMEOUT
+from aiopg.connection import Connection, TIMEOUT, _connect_targets
 from aiopg.cursor import Cursor
 from aiopg.utils import ensure_future, create_future
 from unittest import mock
@@ -65,6 +67,42 @@ def test_default_event_loop(connect, loop):
     assert conn._loop is loop
 
 
+@asyncio.coroutine
+def test_connect_resolves_host_on_loop(loop, pg_params):
+    addr = pg_params['host']
+
+    @asyncio.coroutine
+    def getaddrinfo(host, port, **kwargs):
+        assert 'aiopg.test' == host
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '',
+                 (addr, pg_params['port']))]
+
+    pg_params['host'] = 'aiopg.test'
+    with mock.patch.object(loop, 'getaddrinfo', getaddrinfo):
+        conn = yield from aiopg.connect(loop=loop, **pg_params)
+    try:
+        assert 'hostaddr={}'.format(addr) in conn.raw.dsn
+        assert 'host=aiopg.test' in conn.raw.dsn
+        cur = yield from conn.cursor()
+        yield from cur.execute('SELECT 1')
+        assert (1,) == (yield from cur.fetchone())
+    finally:
+        conn.close()
+
+
+@asyncio.coroutine
+def test_connect_unresolvable_host(loop, pg_params):
+
+    @asyncio.coroutine
+    def getaddrinfo(host, port, **kwargs):
+        raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+
+    pg_params['host'] = 'aiopg.test'
+    with mock.patch.object(loop, 'getaddrinfo', getaddrinfo):
+        with pytest.raises(psycopg2.OperationalError):
+            yield from aiopg.connect(loop=loop, **pg_params)
+
+
 @asyncio.coroutine
 def test_close(connect):
     conn = yield from connect()
@@ -290,6 +328,123 @@ def test_cancel_pending_op(connect, loop):
         yield from task
 
 
+@asyncio.coroutine
+def test_cancel_does_not_block_loop(connect, loop):
+    fut = asyncio.Future(loop=loop)
+
+    @asyncio.coroutine
+    def inner():
+        fut.set_result(None)
+        yield from cur.execute("SELECT pg_sleep(10)")
+
+    conn = yield from connect()
+    assert conn.cancel_latency is None
+    cur = yield from conn.cursor()
+    task = ensure_future(inner(), loop=loop)
+    yield from fut
+    yield from asyncio.sleep(0.1, loop=loop)
+    with mock.patch.object(conn, '_conn', wraps=conn._conn) as m_conn:
+        yield from conn.cancel()
+    assert not m_conn.cancel.called
+    assert conn.cancel_latency >= 0
+
+    with pytest.raises(asyncio.CancelledError):
+        yield from task
+
+
+@asyncio.coroutine
+def test_cancel_falls_back_to_blocking_request(connect, loop):
+    fut = asyncio.Future(loop=loop)
+
+    @asyncio.coroutine
+    def inner():
+        fut.set_result(None)
+        yield from cur.execute("SELECT pg_sleep(10)")
+
+    conn = yield from connect()
+    conn._connect_params = ('baddsn:1', {})
+    cur = yield from conn.cursor()
+    task = ensure_future(inner(), loop=loop)
+    yield from fut
+    yield from asyncio.sleep(0.1, loop=loop)
+    with mock.patch("aiopg.connection.logger") as m_log:
+        yield from conn.cancel()
+    assert m_log.warning.called
+    assert conn.cancel_latency is not None
+
+    with pytest.raises(asyncio.CancelledError):
+        yield from task
+
+
+@asyncio.coroutine
+def test_cancel_checks_backend_start(connect, loop):
+    conn = yield from connect()
+    assert conn._backend[0] == conn._conn.get_backend_pid()
+    # another session reusing the pid
+    conn._backend = (conn._backend[0], conn._backend[1] - datetime.timedelta(
+        seconds=1))
+    cur = yield from conn.cursor()
+    task = ensure_future(cur.execute("SELECT pg_sleep(0.5)"), loop=loop)
+    yield from asyncio.sleep(0.1, loop=loop)
+    yield from conn.cancel()
+    # not cancelled
+    yield from task
+
+
+@asyncio.coroutine
+def test_cancel_unknown_backend_uses_blocking_request(connect, loop):
+    conn = yield from connect()
+    # e.g. behind a connection pooler
+    conn._backend = (conn._backend[0] + 1, conn._backend[1])
+    cur = yield from conn.cursor()
+    task = ensure_future(cur.execute("SELECT pg_sleep(10)"), loop=loop)
+    yield from asyncio.sleep(0.1, loop=loop)
+    with mock.patch.object(conn, '_cancel_backend') as m_cancel:
+        yield from conn.cancel()
+    assert not m_cancel.called
+    with pytest.raises(asyncio.CancelledError):
+        yield from task
+
+
+@asyncio.coroutine
+def test_cancel_side_connections_bounded(connect, loop):
+    conn = yield from connect()
+    cur = yield from conn.cursor()
+    task = ensure_future(cur.execute("SELECT pg_sleep(10)"), loop=loop)
+    yield from asyncio.sleep(0.1, loop=loop)
+    slots = aiopg.connection._cancel_slots
+    for i in range(aiopg.connection.CANCEL_CONNECTIONS):
+        assert slots.acquire(blocking=False)
+    try:
+        with mock.patch.object(conn, '_cancel_backend') as m_cancel:
+            yield from conn.cancel()
+        assert not m_cancel.called
+    finally:
+        for i in range(aiopg.connection.CANCEL_CONNECTIONS):
+            slots.release()
+    with pytest.raises(asyncio.CancelledError):
+        yield from task
+
+
+@asyncio.coroutine
+def test_connect_timeout_to_hanging_server(loop, pg_params):
+    # a server accepting connections but never answering
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+        server.bind(('127.0.0.1', 0))
+        server.listen(5)
+        pg_params.update(host='127.0.0.1', port=server.getsockname()[1])
+        started = loop.time()
+        with pytest.raises(asyncio.TimeoutError):
+            yield from aiopg.connect(loop=loop, timeout=0.1, **pg_params)
+        assert loop.time() - started < 1
+        yield from asyncio.sleep(0.2, loop=loop)
+        # no side connections to cancel the connecting
+        server.setblocking(False)
+        server.accept()[0].close()
+        with pytest.raises(BlockingIOError):
+            server.accept()
+
+
 @asyncio.coroutine
 def test_cancelled_connection_is_usable_asap(connect, loop):
     @asyncio.coroutine
@@ -481,7 +636,7 @@ def test_execute_twice(connect):
     conn = yield from connect()
     cur1 = yield from conn.cursor()
     cur2 = yield from conn.cursor()
-    coro1 = cur1.execute('SELECT 1')
+    coro1 = cur1.execute('SELECT pg_sleep(0.1)')
     fut1 = next(coro1)
     assert isinstance(fut1, asyncio.Future)
     coro2 = cur2.execute('SELECT 2')
@@ -564,6 +719,37 @@ def test_override_cursor_timeout(connect):
     assert 0.08 <= dt <= 0.15, dt
 
 
+@asyncio.coroutine
+def test_timeout_handle_cancelled_on_completion(connect, loop):
+    conn = yield from connect(timeout=10)
+    cur = yield from conn.cursor()
+
+    handles = []
+    orig_call_later = loop.call_later
+
+    def call_later(*args):
+        handle = orig_call_later(*args)
+        handles.append(handle)
+        return handle
+
+    with mock.patch.object(loop, 'call_later', call_later):
+        yield from cur.execute('SELECT 1 FROM pg_sleep(0.01)')
+    assert 1 == len(handles)
+    assert handles[0]._cancelled
+    assert (1,) == (yield from cur.fetchone())
+
+
+@asyncio.coroutine
+def test_poll_completed_operation_does_not_suspend(connect):
+    conn = yield from connect()
+    # polling an idle connection completes the waiter right away
+    waiter = conn._create_waiter('test')
+    with pytest.raises(StopIteration):
+        next(conn._poll(waiter, 10))
+    assert waiter.done()
+    assert conn._waiter is None
+
+
 @asyncio.coroutine
 def test_echo(connect):
     conn = yield from connect(echo=True)
@@ -702,3 +888,138 @@ def test_connection_on_server_restart(connect, pg_server, docker):
             delay *= 2
     else:
         pytest.fail("Cannot connect to the restarted server")
+
+
+@asyncio.coroutine
+def test_fetch(connect):
+    conn = yield from connect()
+    rows = yield from conn.fetch('SELECT generate_series(1, %s)', (3,))
+    assert [(1,), (2,), (3,)] == rows
+    assert [] == (yield from conn.fetch('SELECT 1 WHERE false'))
+
+
+@asyncio.coroutine
+def test_fetchrow(connect):
+    conn = yield from connect()
+    row = yield from conn.fetchrow('SELECT %s, %s', (1, 'a'))
+    assert (1, 'a') == row
+    assert (yield from conn.fetchrow('SELECT 1 WHERE false')) is None
+
+
+@asyncio.coroutine
+def test_fetchval(connect):
+    conn = yield from connect()
+    assert 1 == (yield from conn.fetchval('SELECT 1'))
+    assert 'b' == (yield from conn.fetchval("SELECT 'a', 'b'", column=1))
+    assert (yield from conn.fetchval('SELECT 1 WHERE false')) is None
+
+
+@asyncio.coroutine
+def test_execute(connect):
+    conn = yield from connect()
+    status = yield from conn.execute('CREATE TEMP TABLE tbl_exec (id int)')
+    assert 'CREATE TABLE' == status
+    status = yield from conn.execute(
+        'INSERT INTO tbl_exec VALUES (%s), (%s)', (1, 2))
+    assert 'INSERT 0 2' == status
+
+
+@asyncio.coroutine
+def test_fetch_error(connect):
+    conn = yield from connect()
+    with pytest.raises(psycopg2.ProgrammingError):
+        yield from conn.fetch('SELECT * FROM no_such_table')
+    # the connection is usable after the error
+    assert 1 == (yield from conn.fetchval('SELECT 1'))
+
+
+@asyncio.coroutine
+def test_fetch_timeout(connect):
+    conn = yield from connect()
+    with pytest.raises(asyncio.TimeoutError):
+        yield from conn.fetch('SELECT pg_sleep(10)', timeout=0.1)
+    assert 1 == (yield from conn.fetchval('SELECT 1'))
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="requires fork()")
+@asyncio.coroutine
+def test_close_in_forked_process(connect):
+    conn = yield from connect()
+    pid = os.fork()
+    if not pid:
+        # the child must not terminate the parent's session
+        ok = False
+        try:
+            conn.close()
+            ok = conn.closed
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert 0 == status
+    assert not conn.closed
+    assert 1 == (yield from conn.fetchval('SELECT 1'))
+
+
+def test_connect_targets():
+    assert [] == _connect_targets('host=a port=5432', {})
+    assert [] == _connect_targets(None, {'host': 'a'})
+    assert [('a', '5432'), ('b', '5432')] == _connect_targets(
+        'host=a,b port=5432', {})
+    assert [('a', '1'), ('b', '2')] == _connect_targets(
+        'host=x', {'host': ['a', 'b'], 'port': [1, 2]})
+    assert [('a', None), ('b', None)] == _connect_targets(
+        None, {'host': ('a', 'b')})
+    with pytest.raises(psycopg2.OperationalError):
+        _connect_targets(None, {'host': 'a,b,c', 'port': '1,2'})
+
+
+@pytest.yield_fixture
+def multi_host_params(pg_params, unused_port):
+    # the first host refuses connections
+    params = dict(pg_params, host=[pg_params['host'], pg_params['host']],
+                  port=[unused_port(), pg_params['port']])
+    with mock.patch.dict('aiopg.connection._preferred_targets', clear=True):
+        yield params
+
+
+@asyncio.coroutine
+def test_connect_multi_host_failover(loop, multi_host_params):
+    conn = yield from aiopg.connect(loop=loop, **multi_host_params)
+    try:
+        assert 1 == (yield from conn.fetchval('SELECT 1'))
+        assert 'port={}'.format(multi_host_params['port'][1]) in conn.dsn
+    finally:
+        conn.close()
+    # the answering host is preferred next time
+    targets = tuple(_connect_targets(None, multi_host_params))
+    assert targets[1] == aiopg.connection._preferred_targets[targets]
+
+
+@asyncio.coroutine
+def test_connect_multi_host_races_hanging_host(loop, multi_host_params):
+    # a server accepting connections but never answering
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        multi_host_params['host'][0] = '127.0.0.1'
+        multi_host_params['port'][0] = server.getsockname()[1]
+        started = loop.time()
+        conn = yield from aiopg.connect(loop=loop, attempt_delay=0.05,
+                                        **multi_host_params)
+        assert loop.time() - started < 5
+        conn.close()
+        # the losing attempt is closed already
+        client, _ = server.accept()
+        with client:
+            client.settimeout(1)
+            while client.recv(1024):
+                pass
+
+
+@asyncio.coroutine
+def test_connect_multi_host_all_fail(loop, pg_params, unused_port):
+    pg_params.update(host=[pg_params['host']] * 2,
+                     port=[unused_port(), unused_port()])
+    with pytest.raises(psycopg2.OperationalError) as ctx:
+        yield from aiopg.connect(loop=loop, **pg_params)
+    assert 'could not connect to any host' in str(ctx.value)
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+
+import pytest
+
+import aiopg
+
+
+@pytest.yield_fixture
+def thread_loop():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+
+    yield loop
+
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+@pytest.yield_fixture
+def manager(loop, pg_params):
+    managers = []
+
+    def go(**kwargs):
+        params = pg_params.copy()
+        params.update(kwargs)
+        manager = aiopg.PoolManager(**params)
+        managers.append(manager)
+        return manager
+
+    yield go
+
+    for manager in managers:
+        for pool in manager.pools:
+            coro = manager.close_pool(loop=pool._loop)
+            if pool._loop is loop:
+                loop.run_until_complete(coro)
+            else:
+                asyncio.run_coroutine_threadsafe(coro, pool._loop).result(5)
+
+
+def in_thread(thread_loop, loop, coro):
+    # run the coroutine in the other thread, wait in the test loop
+    return asyncio.wrap_future(
+        asyncio.run_coroutine_threadsafe(coro, thread_loop), loop=loop)
+
+
+def test_invalid_max_connections():
+    with pytest.raises(ValueError):
+        aiopg.PoolManager(max_connections=0)
+
+
+@asyncio.coroutine
+def test_pool_per_loop(thread_loop, manager, loop):
+    mgr = manager(minsize=0)
+    pool = yield from mgr.get_pool(loop=loop)
+    assert pool is (yield from mgr.get_pool(loop=loop))
+    assert pool._loop is loop
+
+    other = yield from in_thread(thread_loop, loop, mgr.get_pool())
+    assert other is not pool
+    assert other._loop is thread_loop
+    assert {pool, other} == set(mgr.pools)
+    assert 1 == (yield from in_thread(thread_loop, loop,
+                                      other.fetchval('SELECT 1')))
+
+
+@asyncio.coroutine
+def test_concurrent_get_pool(manager, loop):
+    mgr = manager(minsize=0)
+    pools = yield from asyncio.gather(
+        *[mgr.get_pool(loop=loop) for _ in range(3)], loop=loop)
+    assert 1 == len(set(pools))
+    assert 1 == len(mgr.pools)
+
+
+@asyncio.coroutine
+def test_close_pool(manager, loop):
+    mgr = manager(minsize=1)
+    pool = yield from mgr.get_pool(loop=loop)
+    yield from mgr.close_pool(loop=loop)
+    assert pool.closed
+    assert [] == mgr.pools
+    assert pool is not (yield from mgr.get_pool(loop=loop))
+
+
+@asyncio.coroutine
+def test_close(manager, loop):
+    mgr = manager(minsize=0)
+    pool = yield from mgr.get_pool(loop=loop)
+    mgr.close()
+    assert mgr.closed
+    with pytest.raises(RuntimeError):
+        yield from mgr.get_pool(loop=loop)
+    yield from asyncio.sleep(0, loop=loop)
+    assert pool._closing
+
+
+@asyncio.coroutine
+def test_global_cap(thread_loop, manager, loop):
+    mgr = manager(minsize=0, max_connections=2)
+    assert 2 == mgr.max_connections
+    pool = yield from mgr.get_pool(loop=loop)
+    conn1 = yield from pool.acquire()
+    conn2 = yield from pool.acquire()
+    assert 2 == mgr.stats()['budget_used']
+
+    @asyncio.coroutine
+    def other_acquire(timeout=None):
+        other = yield from mgr.get_pool()
+        conn = yield from other.acquire(timeout=timeout)
+        try:
+            return (yield from conn.fetchval('SELECT 1'))
+        finally:
+            other.release(conn)
+
+    with pytest.raises(aiopg.PoolTimeoutError):
+        yield from in_thread(thread_loop, loop, other_acquire(0.05))
+
+    fut = in_thread(thread_loop, loop, other_acquire())
+    yield from asyncio.sleep(0.05, loop=loop)
+    assert not fut.done()
+    # the released connection is closed in favor of the other pool
+    pool.release(conn1)
+    assert conn1.closed
+    assert 1 == (yield from fut)
+    pool.release(conn2)
+
+    stats = mgr.stats()
+    assert 2 == stats['pools']
+    assert 2 == stats['budget_used']
+    assert 2 == stats['size']
+    assert 0 == stats['used']
+    assert 3 == stats['created']
+    assert 1 == stats['closed']
+
+
+@asyncio.coroutine
+def test_free_connection_shed(thread_loop, manager, loop):
+    mgr = manager(minsize=0, max_connections=1)
+    pool = yield from mgr.get_pool(loop=loop)
+    assert 1 == (yield from pool.fetchval('SELECT 1'))
+    assert 1 == pool.freesize
+
+    @asyncio.coroutine
+    def other_fetch():
+        other = yield from mgr.get_pool()
+        return (yield from other.fetchval('SELECT 2'))
+
+    assert 2 == (yield from in_thread(thread_loop, loop, other_fetch()))
+    assert 0 == pool.size
+    assert 1 == mgr.stats()['budget_used']
@@ -1,13 +1,18 @@
 import asyncio
+import os
+import select
+import socket
 from unittest import mock
 import pytest
 import sys
 
+import psycopg2
 from psycopg2.extensions import TRANSACTION_STATUS_INTRANS
 
 import aiopg
 from aiopg.connection import Connection, TIMEOUT
-from aiopg.pool import Pool
+from aiopg.pool import Pool, PRE_PING_RETRIES, _WaiterQueue
+from aiopg.utils import create_future, ensure_future
 
 
 @asyncio.coroutine
@@ -609,3 +614,1562 @@ def test_pool_on_connect(create_pool):
         yield from cur.execute('SELECT 1')
 
     assert called
+
+
+@asyncio.coroutine
+def test_pool_on_connect_once_per_connection(create_pool):
+    connected = []
+
+    @asyncio.coroutine
+    def cb(connection):
+        connected.append(connection)
+
+    pool = yield from create_pool(minsize=1, maxsize=2, on_connect=cb)
+    assert 1 == len(connected)
+
+    for _ in range(3):
+        with (yield from pool):
+            pass
+    assert 1 == len(connected)
+
+    with (yield from pool) as conn1:
+        with (yield from pool) as conn2:
+            pass
+    assert [conn1, conn2] == connected
+
+
+@asyncio.coroutine
+def test_pool_on_connect_error(create_pool):
+    @asyncio.coroutine
+    def cb(connection):
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        yield from create_pool(minsize=1, on_connect=cb)
+
+    pool = yield from create_pool(minsize=0, maxsize=1, on_connect=cb)
+    with pytest.raises(ValueError):
+        yield from pool.acquire()
+    assert 0 == pool.size
+    assert 1 == pool.metrics.created
+    assert 1 == pool.metrics.closed
+
+
+@asyncio.coroutine
+def test_pool_on_acquire_and_on_release(create_pool):
+    events = []
+
+    @asyncio.coroutine
+    def on_acquire(connection):
+        events.append(('acquire', connection))
+
+    @asyncio.coroutine
+    def on_release(connection):
+        events.append(('release', connection))
+
+    pool = yield from create_pool(minsize=1, maxsize=1,
+                                  on_acquire=on_acquire,
+                                  on_release=on_release)
+    assert [] == events
+
+    conn = yield from pool.acquire()
+    assert [('acquire', conn)] == events
+    yield from pool.release(conn)
+    assert [('acquire', conn), ('release', conn)] == events
+    assert 1 == pool.freesize
+
+    with (yield from pool) as conn2:
+        assert conn is conn2
+    # the hook is scheduled as a task by the synchronous release
+    yield from asyncio.sleep(0, loop=pool._loop)
+    assert 4 == len(events)
+
+
+@asyncio.coroutine
+def test_pool_on_release_keeps_slot_until_done(create_pool, loop):
+    fut = asyncio.Future(loop=loop)
+
+    @asyncio.coroutine
+    def on_release(connection):
+        yield from fut
+
+    pool = yield from create_pool(minsize=1, maxsize=1,
+                                  on_release=on_release)
+    conn = yield from pool.acquire()
+    release = pool.release(conn)
+    yield from asyncio.sleep(0, loop=loop)
+    assert {conn} == pool._used
+    assert 0 == pool.freesize
+
+    fut.set_result(None)
+    yield from release
+    assert not pool._used
+    assert 1 == pool.freesize
+
+
+@asyncio.coroutine
+def test_pool_on_acquire_error_closes_connection(create_pool):
+    @asyncio.coroutine
+    def on_acquire(connection):
+        raise ValueError()
+
+    pool = yield from create_pool(minsize=1, maxsize=1,
+                                  on_acquire=on_acquire)
+    conn = pool._free[0]
+    with pytest.raises(ValueError):
+        yield from pool.acquire()
+    assert conn.closed
+    assert not pool._used
+    assert 0 == pool.size
+
+
+@asyncio.coroutine
+def test_pool_on_release_error_closes_connection(create_pool):
+    @asyncio.coroutine
+    def on_release(connection):
+        raise ValueError()
+
+    pool = yield from create_pool(minsize=1, maxsize=1,
+                                  on_release=on_release)
+    conn = yield from pool.acquire()
+    yield from pool.release(conn)
+    assert conn.closed
+    assert not pool._used
+    assert 0 == pool.size
+
+
+@asyncio.coroutine
+def test_invalid_max_connecting(create_pool):
+    with pytest.raises(ValueError):
+        yield from create_pool(max_connecting=0)
+
+
+@asyncio.coroutine
+def test_create_pool_opens_connections_concurrently(create_pool, loop):
+    connecting = peak = 0
+    orig_connect = aiopg.pool.connect
+
+    @asyncio.coroutine
+    def connect(*args, **kwargs):
+        nonlocal connecting, peak
+        connecting += 1
+        peak = max(peak, connecting)
+        try:
+            return (yield from orig_connect(*args, **kwargs))
+        finally:
+            connecting -= 1
+
+    with mock.patch('aiopg.pool.connect', connect):
+        pool = yield from create_pool(minsize=6, max_connecting=3)
+    assert 6 == pool.size
+    assert 6 == pool.freesize
+    assert 3 == peak
+
+
+@asyncio.coroutine
+def test_acquire_not_blocked_by_opening_connection(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=2)
+    conn1 = yield from pool.acquire()
+
+    orig_connect = aiopg.pool.connect
+    started = asyncio.Event(loop=loop)
+    proceed = asyncio.Event(loop=loop)
+
+    @asyncio.coroutine
+    def connect(*args, **kwargs):
+        started.set()
+        yield from proceed.wait()
+        return (yield from orig_connect(*args, **kwargs))
+
+    with mock.patch('aiopg.pool.connect', connect):
+        task = ensure_future(pool.acquire(), loop=loop)
+        yield from started.wait()
+        assert 2 == pool.size
+        pool.release(conn1)
+        conn = yield from asyncio.wait_for(pool.acquire(), 1, loop=loop)
+        assert conn is conn1
+        proceed.set()
+        conn2 = yield from task
+    assert conn2 is not conn1
+    pool.release(conn)
+    pool.release(conn2)
+
+
+@asyncio.coroutine
+def test_acquire_waiters_served_in_fifo_order(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1)
+    conn = yield from pool.acquire()
+    order = []
+
+    @asyncio.coroutine
+    def waiter(num):
+        conn = yield from pool.acquire()
+        order.append(num)
+        yield from asyncio.sleep(0, loop=loop)
+        pool.release(conn)
+
+    tasks = [ensure_future(waiter(num), loop=loop) for num in range(5)]
+    yield from asyncio.sleep(0, loop=loop)
+    assert 5 == pool._waiting
+    pool.release(conn)
+    yield from asyncio.gather(*tasks, loop=loop)
+    assert [0, 1, 2, 3, 4] == order
+    assert 1 == pool.size
+    assert 1 == pool.freesize
+
+
+@asyncio.coroutine
+def test_release_hands_connection_to_waiter(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1)
+    conn = yield from pool.acquire()
+    task = ensure_future(pool.acquire(), loop=loop)
+    yield from asyncio.sleep(0, loop=loop)
+
+    fut = pool.release(conn)
+    assert fut.done()
+    assert 0 == pool.freesize
+    assert 1 == pool.size
+    assert conn is (yield from task)
+    assert {conn} == pool._used
+    pool.release(conn)
+
+
+@asyncio.coroutine
+def test_cancelled_waiter_is_skipped(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1)
+    conn = yield from pool.acquire()
+    task1 = ensure_future(pool.acquire(), loop=loop)
+    task2 = ensure_future(pool.acquire(), loop=loop)
+    yield from asyncio.sleep(0, loop=loop)
+    task1.cancel()
+    yield from asyncio.sleep(0, loop=loop)
+
+    pool.release(conn)
+    assert conn is (yield from task2)
+    assert task1.cancelled()
+    pool.release(conn)
+    assert 1 == pool.freesize
+
+
+@asyncio.coroutine
+def test_waiter_cancelled_after_handover(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1)
+    conn = yield from pool.acquire()
+    task1 = ensure_future(pool.acquire(), loop=loop)
+    task2 = ensure_future(pool.acquire(), loop=loop)
+    yield from asyncio.sleep(0, loop=loop)
+
+    pool.release(conn)
+    task1.cancel()
+    assert conn is (yield from task2)
+    assert task1.cancelled()
+    assert 1 == pool.size
+    pool.release(conn)
+
+
+@asyncio.coroutine
+def test_closed_connection_release_wakes_waiter(create_pool, loop):
+    pool = yield from create_pool(minsize=0, maxsize=1)
+    conn = yield from pool.acquire()
+    task = ensure_future(pool.acquire(), loop=loop)
+    yield from asyncio.sleep(0, loop=loop)
+
+    conn.close()
+    pool.release(conn)
+    conn2 = yield from asyncio.wait_for(task, 1, loop=loop)
+    assert conn2 is not conn
+    assert not conn2.closed
+    assert 1 == pool.size
+    pool.release(conn2)
+
+
+@asyncio.coroutine
+def test_close_fails_waiters(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1)
+    conn = yield from pool.acquire()
+    task = ensure_future(pool.acquire(), loop=loop)
+    yield from asyncio.sleep(0, loop=loop)
+
+    pool.close()
+    with pytest.raises(RuntimeError):
+        yield from task
+    pool.release(conn)
+    yield from pool.wait_closed()
+    assert conn.closed
+
+
+@asyncio.coroutine
+def test_acquire_timeout(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1)
+    conn = yield from pool.acquire()
+
+    with pytest.raises(aiopg.PoolTimeoutError):
+        yield from pool.acquire(timeout=0.01)
+    assert 0 == pool._waiting
+
+    task = ensure_future(pool.acquire(timeout=1), loop=loop)
+    yield from asyncio.sleep(0, loop=loop)
+    pool.release(conn)
+    assert conn is (yield from task)
+    pool.release(conn)
+
+
+@asyncio.coroutine
+def test_cancel_waiter_failed_in_same_iteration(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1)
+    conn = yield from pool.acquire()
+    task = ensure_future(pool.acquire(timeout=10), loop=loop)
+    yield from asyncio.sleep(0, loop=loop)
+    # the waiter gets an error and the task is cancelled before waking up
+    pool.close()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        yield from task
+    assert 0 == pool._acquiring
+    assert 1 == pool.size
+    pool.release(conn)
+    yield from pool.wait_closed()
+    assert conn.closed
+
+
+@asyncio.coroutine
+def test_acquire_timeout_is_timeout_error(create_pool):
+    pool = yield from create_pool(minsize=1, maxsize=1)
+    with (yield from pool):
+        with pytest.raises(asyncio.TimeoutError):
+            with (yield from pool.acquire(timeout=0.01)):
+                pass
+
+
+@asyncio.coroutine
+def test_max_waiters(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1, max_waiters=1)
+    assert 1 == pool.max_waiters
+    conn = yield from pool.acquire()
+    task = ensure_future(pool.acquire(), loop=loop)
+    yield from asyncio.sleep(0, loop=loop)
+
+    with pytest.raises(aiopg.PoolOverloadedError):
+        yield from pool.acquire()
+
+    pool.release(conn)
+    assert conn is (yield from task)
+    pool.release(conn)
+
+
+@asyncio.coroutine
+def test_max_waiters_zero_fails_fast(create_pool):
+    pool = yield from create_pool(minsize=1, maxsize=1, max_waiters=0)
+    with (yield from pool):
+        with pytest.raises(aiopg.PoolOverloadedError):
+            yield from pool.acquire()
+    with (yield from pool) as conn:
+        assert not conn.closed
+
+
+@asyncio.coroutine
+def test_invalid_max_waiters(create_pool):
+    with pytest.raises(ValueError):
+        yield from create_pool(max_waiters=-1)
+
+
+@asyncio.coroutine
+def test_stats(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=2)
+    stats = pool.stats()
+    assert 1 == stats['size']
+    assert 1 == stats['freesize']
+    assert 0 == stats['used']
+    assert 1 == stats['created']
+    assert 0 == stats['acquired']
+
+    conn1 = yield from pool.acquire()
+    conn2 = yield from pool.acquire()
+    task = ensure_future(pool.acquire(), loop=loop)
+    yield from asyncio.sleep(0.01, loop=loop)
+    stats = pool.stats()
+    assert 2 == stats['used']
+    assert 1 == stats['waiting']
+    assert 2 == stats['created']
+
+    pool.release(conn1)
+    conn3 = yield from task
+    pool.release(conn2)
+    pool.release(conn3)
+
+    stats = pool.stats()
+    assert 3 == stats['acquired']
+    assert 2 == stats['peak_used']
+    assert 1 == stats['peak_waiting']
+    assert 0 == stats['waiting']
+    assert 3 == stats['acquire_wait']['count']
+    assert stats['acquire_wait']['max'] >= 0.01
+    assert 3 == stats['hold_time']['count']
+    assert stats['hold_time']['max'] >= 0.01
+    assert 0 == stats['closed']
+
+    pool.close()
+    yield from pool.wait_closed()
+    assert 2 == pool.stats()['closed']
+
+
+@asyncio.coroutine
+def test_stats_counts_recycled_and_failures(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1, pool_recycle=0.01,
+                                  max_waiters=1)
+    assert pool.metrics is pool.metrics
+    yield from asyncio.sleep(0.02, loop=loop)
+    with (yield from pool):
+        task = ensure_future(pool.acquire(timeout=0.01), loop=loop)
+        yield from asyncio.sleep(0, loop=loop)
+        with pytest.raises(aiopg.PoolOverloadedError):
+            yield from pool.acquire()
+        with pytest.raises(aiopg.PoolTimeoutError):
+            yield from task
+
+    metrics = pool.metrics
+    assert 1 == metrics.recycled
+    assert 1 == metrics.closed
+    assert 2 == metrics.created
+    assert 1 == metrics.timeouts
+    assert 1 == metrics.overloaded
+
+
+@asyncio.coroutine
+def test_invalid_max_idle_and_max_lifetime(create_pool):
+    with pytest.raises(ValueError):
+        yield from create_pool(max_idle=0)
+    with pytest.raises(ValueError):
+        yield from create_pool(max_lifetime=-1)
+
+
+@asyncio.coroutine
+def test_no_maintenance_task_by_default(create_pool):
+    pool = yield from create_pool()
+    assert pool._maintenance_task is None
+    assert pool.max_idle is None
+    assert pool.max_lifetime is None
+
+
+@asyncio.coroutine
+def test_max_idle_shrinks_to_minsize(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=3, max_idle=0.1)
+    assert 0.1 == pool.max_idle
+    conns = []
+    for _ in range(3):
+        conns.append((yield from pool.acquire()))
+    for conn in conns:
+        pool.release(conn)
+    assert 3 == pool.freesize
+
+    yield from asyncio.sleep(0.3, loop=loop)
+    assert 1 == pool.size
+    assert 1 == pool.freesize
+    assert 2 == pool.metrics.idle_closed
+    assert sum(conn.closed for conn in conns) == 2
+
+
+@asyncio.coroutine
+def test_max_lifetime_reopens_free_connections(create_pool, loop):
+    pool = yield from create_pool(minsize=2, maxsize=2, max_lifetime=0.1)
+    assert 0.1 == pool.max_lifetime
+    old = list(pool._free)
+
+    yield from asyncio.sleep(0.2, loop=loop)
+    assert all(conn.closed for conn in old)
+    assert 2 == pool.freesize
+    assert not any(conn.closed for conn in pool._free)
+    assert 2 <= pool.metrics.expired
+
+
+@asyncio.coroutine
+def test_max_lifetime_jitter(create_pool, loop):
+    pool = yield from create_pool(minsize=5, maxsize=5, max_lifetime=100)
+    now = loop.time()
+    deadlines = [pool._expires_at[conn] for conn in pool._free]
+    assert all(now + 89 < deadline <= now + 100 for deadline in deadlines)
+    assert len(set(deadlines)) == 5
+
+
+@asyncio.coroutine
+def test_max_lifetime_closes_on_release(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1, max_lifetime=60)
+    conn = yield from pool.acquire()
+    pool._expires_at[conn] = loop.time()
+    pool.release(conn)
+    assert conn.closed
+    assert 0 == pool.size
+    assert 1 == pool.metrics.expired
+
+
+@asyncio.coroutine
+def test_close_stops_maintenance(create_pool):
+    pool = yield from create_pool(minsize=1, max_idle=10)
+    task = pool._maintenance_task
+    assert not task.done()
+    pool.close()
+    yield from pool.wait_closed()
+    assert task.cancelled()
+    assert pool._maintenance_task is None
+
+
+@asyncio.coroutine
+def test_invalid_min_idle(create_pool):
+    with pytest.raises(ValueError):
+        yield from create_pool(min_idle=-1)
+    with pytest.raises(ValueError):
+        yield from create_pool(maxsize=2, min_idle=3)
+
+
+@asyncio.coroutine
+def test_min_idle_keeps_connections_warm(create_pool, loop):
+    with mock.patch('aiopg.pool.MAINTENANCE_INTERVAL', 0.01):
+        pool = yield from create_pool(minsize=0, maxsize=3, min_idle=1)
+    assert 1 == pool.min_idle
+    assert 1 == pool.freesize
+
+    conn1 = yield from pool.acquire()
+    assert 0 == pool.freesize
+    yield from asyncio.sleep(0.1, loop=loop)
+    assert 1 == pool.freesize
+    assert 2 == pool.size
+
+    conn2 = yield from pool.acquire()
+    conn3 = yield from pool.acquire()
+    yield from asyncio.sleep(0.1, loop=loop)
+    # maxsize is reached
+    assert 0 == pool.freesize
+    for conn in (conn1, conn2, conn3):
+        pool.release(conn)
+
+
+@asyncio.coroutine
+def test_maintenance_drops_closed_connections(create_pool, loop):
+    with mock.patch('aiopg.pool.MAINTENANCE_INTERVAL', 0.01):
+        pool = yield from create_pool(minsize=2, maxsize=2, min_idle=1)
+    old = list(pool._free)
+    for conn in old:
+        conn.close()
+    yield from asyncio.sleep(0.1, loop=loop)
+    assert 2 == pool.freesize
+    assert not any(conn in old for conn in pool._free)
+    assert 2 == pool.metrics.closed
+
+
+@asyncio.coroutine
+def test_maintenance_reconnect_backoff(create_pool, loop):
+    attempts = []
+
+    @asyncio.coroutine
+    def failing_connect(*args, **kwargs):
+        attempts.append(loop.time())
+        raise OSError("connection refused")
+
+    with mock.patch('aiopg.pool.MAINTENANCE_INTERVAL', 0.01):
+        pool = yield from create_pool(minsize=1, maxsize=1, min_idle=1)
+    conn = pool._free[0]
+    conn.close()
+    with mock.patch('aiopg.pool.connect', failing_connect):
+        yield from asyncio.sleep(0.3, loop=loop)
+    assert 2 <= len(attempts) <= 6
+    assert attempts[-1] - attempts[-2] > attempts[1] - attempts[0]
+    assert len(attempts) == pool.metrics.connect_errors
+
+    yield from asyncio.sleep(0.7, loop=loop)
+    assert 1 == pool.freesize
+    assert not pool._free[0].closed
+
+
+@asyncio.coroutine
+def test_invalid_strategy(create_pool):
+    with pytest.raises(ValueError):
+        yield from create_pool(strategy='random')
+
+
+@asyncio.coroutine
+def test_fifo_strategy(create_pool):
+    pool = yield from create_pool(minsize=2, maxsize=2)
+    assert 'fifo' == pool.strategy
+    conn1 = yield from pool.acquire()
+    conn2 = yield from pool.acquire()
+    pool.release(conn1)
+    pool.release(conn2)
+    assert conn1 is (yield from pool.acquire())
+    assert conn2 is (yield from pool.acquire())
+    pool.release(conn1)
+    pool.release(conn2)
+
+
+@asyncio.coroutine
+def test_lifo_strategy(create_pool):
+    pool = yield from create_pool(minsize=2, maxsize=2, strategy='lifo')
+    assert 'lifo' == pool.strategy
+    conn1 = yield from pool.acquire()
+    conn2 = yield from pool.acquire()
+    pool.release(conn1)
+    pool.release(conn2)
+    for _ in range(3):
+        with (yield from pool) as conn:
+            assert conn is conn2
+    assert conn2 is (yield from pool.acquire())
+    assert conn1 is (yield from pool.acquire())
+    pool.release(conn1)
+    pool.release(conn2)
+
+
+@asyncio.coroutine
+def test_lifo_strategy_lets_idle_connections_age_out(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=3, strategy='lifo',
+                                  max_idle=0.1)
+    conns = []
+    for _ in range(3):
+        conns.append((yield from pool.acquire()))
+    for conn in conns:
+        pool.release(conn)
+
+    for _ in range(10):
+        with (yield from pool) as conn:
+            assert conn is conns[-1]
+            cur = yield from conn.cursor()
+            yield from cur.execute('SELECT 1')
+        yield from asyncio.sleep(0.03, loop=loop)
+    assert 1 == pool.size
+    assert conns[0].closed and conns[1].closed
+    assert not conns[2].closed
+
+
+def _execute_blocking(pg_params, sql, params=None):
+    # the event loop is blocked, pool connections can't notice
+    # anything sent to them until they are checked
+    killer = psycopg2.connect(**pg_params)
+    try:
+        killer.autocommit = True
+        killer.cursor().execute(sql, params)
+    finally:
+        killer.close()
+
+
+def _terminate_backend(pg_params, conn):
+    pid = conn.raw.get_backend_pid()
+    _execute_blocking(pg_params, 'SELECT pg_terminate_backend(%s)', (pid,))
+    assert _wait_readable(conn._fileno, 1)
+
+
+def _wait_readable(fd, timeout):
+    # select() can't wait for descriptors above FD_SETSIZE
+    if not hasattr(select, 'poll'):  # pragma: no cover
+        return select.select([fd], [], [], timeout)[0]
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    return poller.poll(timeout * 1000)
+
+
+@asyncio.coroutine
+def test_invalid_pre_ping_idle(create_pool):
+    with pytest.raises(ValueError):
+        yield from create_pool(pre_ping_idle=-1)
+
+
+@asyncio.coroutine
+def test_pre_ping_socket_check(create_pool, pg_params):
+    pool = yield from create_pool(minsize=1, maxsize=1, pre_ping=True)
+    assert pool.pre_ping
+    assert pool.pre_ping_idle is None
+    old = pool._free[0]
+    _terminate_backend(pg_params, old)
+
+    with (yield from pool) as conn:
+        assert conn is not old
+        cur = yield from conn.cursor()
+        yield from cur.execute('SELECT 1')
+    assert old.closed
+    assert 1 == pool.metrics.ping_failed
+    assert 0 == pool.metrics.pings
+    assert 1 == pool.size
+
+
+@asyncio.coroutine
+def test_no_pre_ping_hands_out_broken_connection(create_pool, pg_params):
+    pool = yield from create_pool(minsize=1, maxsize=1)
+    assert not pool.pre_ping
+    old = pool._free[0]
+    _terminate_backend(pg_params, old)
+
+    with (yield from pool) as conn:
+        assert conn is old
+
+
+@asyncio.coroutine
+def test_pre_ping_idle_query(create_pool, pg_params):
+    pool = yield from create_pool(minsize=1, maxsize=1, pre_ping_idle=0)
+    assert pool.pre_ping
+    old = pool._free[0]
+    _terminate_backend(pg_params, old)
+
+    with mock.patch('aiopg.pool._socket_alive', return_value=True):
+        with (yield from pool) as conn:
+            assert conn is not old
+        # the replacement is pinged too
+        assert 2 == pool.metrics.pings
+        assert 1 == pool.metrics.ping_failed
+
+        with (yield from pool) as conn2:
+            assert conn2 is conn
+        assert 3 == pool.metrics.pings
+        assert 1 == pool.metrics.ping_failed
+
+
+@asyncio.coroutine
+def test_pre_ping_keeps_connection_with_notification(create_pool,
+                                                     pg_params):
+    pool = yield from create_pool(minsize=1, maxsize=1, pre_ping=True)
+    with (yield from pool) as conn:
+        cur = yield from conn.cursor()
+        yield from cur.execute('LISTEN aiopg_test')
+    _execute_blocking(pg_params, "NOTIFY aiopg_test, 'x'")
+    assert select.select([conn._fileno], [], [], 1)[0]
+
+    with (yield from pool) as conn2:
+        assert conn2 is conn
+    assert 0 == pool.metrics.ping_failed
+    assert 'x' == conn.notifies.get_nowait().payload
+
+
+@asyncio.coroutine
+def test_pre_ping_idle_skips_recently_used(create_pool):
+    pool = yield from create_pool(minsize=1, maxsize=1, pre_ping_idle=60)
+    with (yield from pool):
+        pass
+    assert 0 == pool.metrics.pings
+
+
+@asyncio.coroutine
+def test_pre_ping_high_fds(create_pool, pg_params):
+    # select() can't check descriptors above FD_SETSIZE (1024)
+    resource = pytest.importorskip('resource')
+    limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if limit[1] != resource.RLIM_INFINITY and limit[1] < 1200:
+        pytest.skip("Too low limit of open files")
+    if limit[0] != resource.RLIM_INFINITY and limit[0] < 1200:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (1200, limit[1]))
+    fds = []
+    try:
+        while len(fds) < 1100:
+            fds.append(os.open(os.devnull, os.O_RDONLY))
+        pool = yield from create_pool(minsize=1, maxsize=2, pre_ping=True)
+        old = pool._free[0]
+        assert old._fileno >= 1024
+        conn = yield from pool.acquire(timeout=5)
+        assert conn is old
+        pool.release(conn)
+        assert 0 == pool.metrics.ping_failed
+
+        _terminate_backend(pg_params, old)
+        conn = yield from pool.acquire(timeout=5)
+        assert conn is not old
+        pool.release(conn)
+        assert 1 == pool.metrics.ping_failed
+    finally:
+        for fd in fds:
+            os.close(fd)
+        resource.setrlimit(resource.RLIMIT_NOFILE, limit)
+
+
+@asyncio.coroutine
+def test_pre_ping_unknown_socket_state_queries(create_pool):
+    pool = yield from create_pool(minsize=1, maxsize=1, pre_ping=True)
+    old = pool._free[0]
+    with mock.patch('aiopg.pool._socket_alive', return_value=None):
+        with (yield from pool) as conn:
+            assert conn is old
+    assert 1 == pool.metrics.pings
+    assert 0 == pool.metrics.ping_failed
+
+
+@asyncio.coroutine
+def test_pre_ping_replacements_bounded(create_pool):
+    pool = yield from create_pool(minsize=1, maxsize=2, pre_ping=True)
+    # a server closing every connection right after opening
+    with mock.patch('aiopg.pool._socket_alive', return_value=False):
+        with pytest.raises(psycopg2.OperationalError):
+            yield from pool.acquire(timeout=5)
+    assert 1 + PRE_PING_RETRIES + 1 == pool.metrics.ping_failed
+    with (yield from pool):
+        pass
+
+
+@asyncio.coroutine
+def _failing_connect(*args, **kwargs):
+    raise psycopg2.OperationalError("connection refused")
+
+
+@asyncio.coroutine
+def test_invalid_breaker_params(create_pool):
+    with pytest.raises(ValueError):
+        yield from create_pool(breaker_threshold=0)
+    with pytest.raises(ValueError):
+        yield from create_pool(breaker_timeout=0)
+
+
+@asyncio.coroutine
+def test_circuit_breaker_disabled_by_default(create_pool):
+    pool = yield from create_pool(minsize=0, maxsize=1)
+    with mock.patch('aiopg.pool.connect', _failing_connect):
+        for _ in range(5):
+            with pytest.raises(psycopg2.OperationalError) as ctx:
+                yield from pool.acquire()
+            assert not isinstance(ctx.value, aiopg.PoolCircuitOpenError)
+    assert 'closed' == pool.circuit_state
+
+
+@asyncio.coroutine
+def test_circuit_breaker_opens_and_fails_fast(create_pool):
+    pool = yield from create_pool(minsize=0, maxsize=2,
+                                  breaker_threshold=2, breaker_timeout=10)
+    assert 'closed' == pool.circuit_state
+    with mock.patch('aiopg.pool.connect',
+                    side_effect=_failing_connect) as connect:
+        for _ in range(2):
+            with pytest.raises(psycopg2.OperationalError):
+                yield from pool.acquire()
+        assert 'open' == pool.circuit_state
+        assert 'open' == pool.stats()['circuit_state']
+        assert 1 == pool.metrics.circuit_opened
+
+        for _ in range(10):
+            with pytest.raises(aiopg.PoolCircuitOpenError):
+                yield from pool.acquire()
+        assert 2 == connect.call_count
+    assert 0 == pool.size
+    # rejections are not connection attempts
+    assert 2 == pool.metrics.connect_errors
+
+
+@asyncio.coroutine
+def test_circuit_breaker_ignores_on_connect_errors(create_pool):
+    @asyncio.coroutine
+    def cb(connection):
+        raise ValueError()
+
+    pool = yield from create_pool(minsize=0, maxsize=1, on_connect=cb,
+                                  breaker_threshold=1, breaker_timeout=10)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            yield from pool.acquire()
+    assert 'closed' == pool.circuit_state
+    assert 0 == pool.metrics.connect_errors
+    assert 0 == pool.size
+
+
+@asyncio.coroutine
+def test_circuit_breaker_serves_free_connections(create_pool):
+    pool = yield from create_pool(minsize=1, maxsize=2,
+                                  breaker_threshold=1, breaker_timeout=10)
+    conn = yield from pool.acquire()
+    with mock.patch('aiopg.pool.connect', _failing_connect):
+        with pytest.raises(psycopg2.OperationalError):
+            yield from pool.acquire()
+    assert 'open' == pool.circuit_state
+    pool.release(conn)
+    with (yield from pool) as conn2:
+        assert conn2 is conn
+
+
+@asyncio.coroutine
+def test_circuit_breaker_half_open_probe(create_pool, loop):
+    pool = yield from create_pool(minsize=0, maxsize=2,
+                                  breaker_threshold=1, breaker_timeout=0.05)
+    with mock.patch('aiopg.pool.connect', _failing_connect):
+        with pytest.raises(psycopg2.OperationalError):
+            yield from pool.acquire()
+        assert 'open' == pool.circuit_state
+
+        yield from asyncio.sleep(0.06, loop=loop)
+        assert 'half-open' == pool.circuit_state
+        # failed probe opens the circuit for twice longer
+        with pytest.raises(psycopg2.OperationalError) as ctx:
+            yield from pool.acquire()
+        assert not isinstance(ctx.value, aiopg.PoolCircuitOpenError)
+        assert 'open' == pool.circuit_state
+        assert 0.1 == pool._circuit_timeout
+
+        yield from asyncio.sleep(0.06, loop=loop)
+        with pytest.raises(aiopg.PoolCircuitOpenError):
+            yield from pool.acquire()
+
+    yield from asyncio.sleep(0.05, loop=loop)
+    assert 'half-open' == pool.circuit_state
+    with (yield from pool):
+        pass
+    assert 'closed' == pool.circuit_state
+    assert 0.05 == pool._circuit_timeout
+    assert 2 == pool.metrics.circuit_opened
+
+
+@asyncio.coroutine
+def test_circuit_breaker_single_probe(create_pool, loop):
+    pool = yield from create_pool(minsize=0, maxsize=2,
+                                  breaker_threshold=1, breaker_timeout=0.01)
+    with mock.patch('aiopg.pool.connect', _failing_connect):
+        with pytest.raises(psycopg2.OperationalError):
+            yield from pool.acquire()
+    yield from asyncio.sleep(0.02, loop=loop)
+
+    probe = ensure_future(pool.acquire(), loop=loop)
+    yield from asyncio.sleep(0, loop=loop)
+    with pytest.raises(aiopg.PoolCircuitOpenError):
+        yield from pool.acquire()
+    conn = yield from probe
+    assert 'closed' == pool.circuit_state
+    pool.release(conn)
+
+
+@asyncio.coroutine
+def test_invalid_starvation_timeout(create_pool):
+    with pytest.raises(ValueError):
+        yield from create_pool(starvation_timeout=-1)
+
+
+@asyncio.coroutine
+def test_acquire_priority(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1)
+    conn = yield from pool.acquire()
+    order = []
+
+    @asyncio.coroutine
+    def waiter(name, priority):
+        conn = yield from pool.acquire(priority=priority)
+        order.append(name)
+        yield from asyncio.sleep(0, loop=loop)
+        pool.release(conn)
+
+    tasks = [ensure_future(waiter(name, priority), loop=loop)
+             for name, priority in [('batch1', -1), ('web1', 10),
+                                    ('default', 0), ('batch2', -1),
+                                    ('web2', 10)]]
+    yield from asyncio.sleep(0, loop=loop)
+    assert {-1: 2, 0: 1, 10: 2} == pool.stats()['waiting_by_priority']
+    pool.release(conn)
+    yield from asyncio.gather(*tasks, loop=loop)
+    assert ['web1', 'web2', 'default', 'batch1', 'batch2'] == order
+    assert {} == pool.stats()['waiting_by_priority']
+
+
+@asyncio.coroutine
+def test_acquire_priority_anti_starvation(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1,
+                                  starvation_timeout=0.05)
+    conn = yield from pool.acquire()
+    low = ensure_future(pool.acquire(priority=-1), loop=loop)
+    yield from asyncio.sleep(0.06, loop=loop)
+    high = ensure_future(pool.acquire(priority=1), loop=loop)
+    yield from asyncio.sleep(0, loop=loop)
+
+    pool.release(conn)
+    assert conn is (yield from low)
+    assert not high.done()
+    pool.release(conn)
+    assert conn is (yield from high)
+    pool.release(conn)
+
+
+@asyncio.coroutine
+def test_acquire_priority_without_starvation_timeout(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1,
+                                  starvation_timeout=None)
+    conn = yield from pool.acquire()
+    low = ensure_future(pool.acquire(priority=-1), loop=loop)
+    yield from asyncio.sleep(0.01, loop=loop)
+    high = ensure_future(pool.acquire(priority=1), loop=loop)
+    yield from asyncio.sleep(0, loop=loop)
+
+    pool.release(conn)
+    assert conn is (yield from high)
+    pool.release(conn)
+    assert conn is (yield from low)
+    pool.release(conn)
+
+
+@asyncio.coroutine
+def test_acquire_priority_skips_cancelled(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1)
+    conn = yield from pool.acquire()
+    high = ensure_future(pool.acquire(priority=1), loop=loop)
+    low = ensure_future(pool.acquire(), loop=loop)
+    yield from asyncio.sleep(0, loop=loop)
+    high.cancel()
+    yield from asyncio.sleep(0, loop=loop)
+    assert {0: 1} == pool.stats()['waiting_by_priority']
+
+    pool.release(conn)
+    assert conn is (yield from low)
+    pool.release(conn)
+
+
+@asyncio.coroutine
+def test_invalid_partitions(create_pool):
+    with pytest.raises(ValueError):
+        yield from create_pool(maxsize=0, partitions={'a': (0, 1)})
+    with pytest.raises(ValueError):
+        yield from create_pool(maxsize=4, partitions={'a': (2, 1)})
+    with pytest.raises(ValueError):
+        yield from create_pool(maxsize=4, partitions={'a': (1, 5)})
+    with pytest.raises(ValueError):
+        yield from create_pool(maxsize=4, partitions={'a': (3, 4),
+                                                      'b': (2, 4)})
+    with pytest.raises(ValueError):
+        yield from create_pool(maxsize=4, partitions={None: (0, 1)})
+
+
+@asyncio.coroutine
+def test_unknown_partition(create_pool):
+    pool = yield from create_pool(minsize=0)
+    assert () == pool.partitions
+    with pytest.raises(ValueError):
+        yield from pool.acquire(partition='oltp')
+
+    pool = yield from create_pool(minsize=0, partitions={'oltp': (1, 2)})
+    with pytest.raises(ValueError):
+        yield from pool.acquire(partition='reporting')
+
+
+@asyncio.coroutine
+def test_partition_fractions(create_pool):
+    pool = yield from create_pool(minsize=0, maxsize=10,
+                                  partitions={'oltp': (0.7, 1.0),
+                                              'reporting': (0.0, 0.3)})
+    assert {'oltp', 'reporting'} == set(pool.partitions)
+    stats = pool.stats()['partitions']
+    assert (7, 10) == (stats['oltp']['min'], stats['oltp']['max'])
+    assert (0, 3) == (stats['reporting']['min'],
+                      stats['reporting']['max'])
+
+
+@asyncio.coroutine
+def test_partition_max(create_pool, loop):
+    pool = yield from create_pool(minsize=0, maxsize=4,
+                                  partitions={'reporting': (0, 2)})
+    conn1 = yield from pool.acquire(partition='reporting')
+    conn2 = yield from pool.acquire(partition='reporting')
+    task = ensure_future(pool.acquire(partition='reporting'), loop=loop)
+    yield from asyncio.sleep(0.01, loop=loop)
+    assert not task.done()
+
+    # other workloads are not affected
+    with (yield from pool):
+        pass
+    stats = pool.stats()['partitions']['reporting']
+    assert 2 == stats['used']
+    assert 1 == stats['waiting']
+
+    pool.release(conn1)
+    conn3 = yield from task
+    assert conn3 is conn1
+    pool.release(conn2)
+    pool.release(conn3)
+    stats = pool.stats()['partitions']['reporting']
+    assert 0 == stats['used']
+    assert 3 == stats['acquired']
+    assert 3 == stats['hold_time']['count']
+
+
+@asyncio.coroutine
+def test_partition_min_is_reserved(create_pool, loop):
+    pool = yield from create_pool(minsize=0, maxsize=3,
+                                  partitions={'oltp': (2, 3),
+                                              'reporting': (0, 3)})
+    conn1 = yield from pool.acquire(partition='reporting')
+    # the rest is reserved for oltp
+    task = ensure_future(pool.acquire(partition='reporting', timeout=0.05),
+                         loop=loop)
+    with pytest.raises(aiopg.PoolTimeoutError):
+        yield from task
+    assert 1 == pool.stats()['partitions']['reporting']['timeouts']
+    with pytest.raises(aiopg.PoolTimeoutError):
+        yield from pool.acquire(timeout=0.01)
+
+    conn2 = yield from pool.acquire(partition='oltp')
+    conn3 = yield from pool.acquire(partition='oltp')
+    assert 3 == pool.size
+    task = ensure_future(pool.acquire(partition='oltp'), loop=loop)
+    yield from asyncio.sleep(0, loop=loop)
+    pool.release(conn1)
+    assert conn1 is (yield from task)
+    for conn in (conn1, conn2, conn3):
+        pool.release(conn)
+
+
+@asyncio.coroutine
+def test_partition_waits_despite_free_connections(create_pool, loop):
+    pool = yield from create_pool(minsize=3, maxsize=3,
+                                  partitions={'oltp': (2, 3),
+                                              'reporting': (0, 3)})
+    conn1 = yield from pool.acquire(partition='reporting')
+    task = ensure_future(pool.acquire(partition='reporting'), loop=loop)
+    yield from asyncio.sleep(0.01, loop=loop)
+    assert not task.done()
+    assert 2 == pool.freesize
+
+    conn2 = yield from pool.acquire(partition='oltp')
+    conn3 = yield from pool.acquire(partition='oltp')
+    assert not task.done()
+    # the released connection is still reserved for oltp
+    pool.release(conn3)
+    yield from asyncio.sleep(0.01, loop=loop)
+    assert not task.done()
+    assert 1 == pool.freesize
+
+    pool.release(conn1)
+    assert conn1 is (yield from task)
+    for conn in (conn1, conn2):
+        pool.release(conn)
+    assert 0 == sum(part['used'] for part
+                    in pool.stats()['partitions'].values())
+
+
+@asyncio.coroutine
+def test_invalid_tenant_params(create_pool):
+    with pytest.raises(ValueError):
+        yield from create_pool(tenant_limit=0)
+    with pytest.raises(ValueError):
+        yield from create_pool(tenant_weights={'a': 0})
+
+
+@asyncio.coroutine
+def test_tenant_limit(create_pool, loop):
+    pool = yield from create_pool(minsize=0, maxsize=4, tenant_limit=1)
+    assert 1 == pool.tenant_limit
+    conn1 = yield from pool.acquire(tenant='noisy')
+    task = ensure_future(pool.acquire(tenant='noisy'), loop=loop)
+    yield from asyncio.sleep(0.01, loop=loop)
+    assert not task.done()
+
+    # other tenants are not affected
+    conn2 = yield from pool.acquire(tenant='quiet')
+    pool.release(conn2)
+    assert 1 == pool.freesize
+    stats = pool.stats()['tenants']
+    assert 1 == stats['noisy']['used']
+    assert 1 == stats['noisy']['waiting']
+    assert 1 == stats['quiet']['acquired']
+
+    pool.release(conn1)
+    conn3 = yield from task
+    assert conn3 is conn1
+    pool.release(conn3)
+    stats = pool.stats()['tenants']['noisy']
+    assert 0 == stats['used']
+    assert 2 == stats['acquired']
+    assert 2 == stats['acquire_wait']['count']
+    assert 2 == stats['hold_time']['count']
+
+
+@asyncio.coroutine
+def test_tenant_limit_timeout(create_pool):
+    pool = yield from create_pool(minsize=0, tenant_limit=1)
+    conn = yield from pool.acquire(tenant=42)
+    with pytest.raises(aiopg.PoolTimeoutError):
+        yield from pool.acquire(tenant=42, timeout=0.01)
+    assert 1 == pool.stats()['tenants'][42]['timeouts']
+    pool.release(conn)
+
+
+@asyncio.coroutine
+def test_idle_tenants_forgotten(create_pool):
+    pool = yield from create_pool(minsize=0, tenant_limit=1)
+    held = yield from pool.acquire(tenant='held')
+    with mock.patch('aiopg.pool.RECENT_TENANTS', 2):
+        for tenant in range(10):
+            conn = yield from pool.acquire(tenant=tenant)
+            pool.release(conn)
+    # the busy tenant and the recent idle ones only
+    assert {'held', 8, 9} == set(pool.stats()['tenants'])
+    assert 1 == pool.stats()['tenants'][9]['acquired']
+    pool.release(held)
+
+
+def test_waiter_queue_checks_workload_once(loop):
+    queue = _WaiterQueue(None)
+    noisy, quiet = ('noisy',), ('quiet',)
+    for i in range(100):
+        queue.append(create_future(loop), 0, 0, noisy)
+    waiter = create_future(loop)
+    queue.append(waiter, 0, 0, quiet)
+    checked = []
+
+    def eligible(key):
+        checked.append(key)
+        return key is quiet
+
+    assert (waiter, quiet) == queue.pop(0, eligible)
+    # a check per waiting workload, not per waiter
+    assert [noisy, quiet] == checked
+    assert {0: 100} == queue.depths()
+
+
+@asyncio.coroutine
+def _serve_tenants(pool, loop, *groups):
+    # queue waiters of tenants behind the only connection, return
+    # the order they are served in
+    order = []
+
+    @asyncio.coroutine
+    def work(tenant):
+        conn = yield from pool.acquire(tenant=tenant)
+        order.append(tenant)
+        pool.release(conn)
+
+    conn = yield from pool.acquire()
+    tasks = []
+    for tenant, count in groups:
+        tasks.extend(ensure_future(work(tenant), loop=loop)
+                     for _ in range(count))
+        yield from asyncio.sleep(0, loop=loop)
+    pool.release(conn)
+    yield from asyncio.gather(*tasks, loop=loop)
+    return order
+
+
+@asyncio.coroutine
+def test_tenant_fair_queuing(create_pool, loop):
+    pool = yield from create_pool(minsize=0, maxsize=1)
+    order = yield from _serve_tenants(pool, loop, ('noisy', 5), ('quiet', 1))
+    # the quiet tenant doesn't wait for all noisy waiters
+    assert ['noisy', 'quiet', 'noisy', 'noisy', 'noisy', 'noisy'] == order
+
+
+@asyncio.coroutine
+def test_tenant_weights(create_pool, loop):
+    pool = yield from create_pool(minsize=0, maxsize=1,
+                                  tenant_weights={'a': 2})
+    order = yield from _serve_tenants(pool, loop, ('a', 4), ('b', 4))
+    assert 'aabaabbb' == ''.join(order)
+    assert 2 == pool.stats()['tenants']['a']['weight']
+
+
+@asyncio.coroutine
+def test_task_affinity_disabled(create_pool):
+    pool = yield from create_pool(minsize=0)
+    assert not pool.task_affinity
+    conn1 = yield from pool.acquire()
+    conn2 = yield from pool.acquire()
+    assert conn1 is not conn2
+    pool.release(conn1)
+    pool.release(conn2)
+
+
+@asyncio.coroutine
+def test_task_affinity(create_pool, loop):
+    pool = yield from create_pool(minsize=0, task_affinity=True)
+    assert pool.task_affinity
+    conn1 = yield from pool.acquire()
+    with (yield from pool) as conn2:
+        assert conn2 is conn1
+        assert 1 == pool.size
+    assert 1 == len(pool._used)
+
+    # other tasks don't share the connection
+    conn3 = yield from ensure_future(pool.acquire(), loop=loop)
+    assert conn3 is not conn1
+    pool.release(conn3)
+
+    pool.release(conn1)
+    assert 2 == pool.freesize
+    stats = pool.stats()
+    assert 1 == stats['shared']
+    assert 2 == stats['acquired']
+    assert 2 == stats['hold_time']['count']
+
+    # the released connection is not bound to the task anymore
+    conn4 = yield from pool.acquire()
+    conn5 = yield from pool.acquire()
+    assert conn4 is conn5
+    pool.release(conn5)
+    pool.release(conn4)
+    assert not pool._task_conns
+    assert not pool._task_refs
+
+
+@asyncio.coroutine
+def test_task_affinity_closed_connection(create_pool):
+    pool = yield from create_pool(minsize=0, task_affinity=True)
+    conn1 = yield from pool.acquire()
+    conn1.close()
+    conn2 = yield from pool.acquire()
+    assert conn2 is not conn1
+    conn3 = yield from pool.acquire()
+    assert conn3 is conn2
+    pool.release(conn1)
+    pool.release(conn3)
+    pool.release(conn2)
+    assert 1 == pool.freesize
+    assert not pool._task_conns
+
+
+@asyncio.coroutine
+def test_fetch_methods(create_pool):
+    pool = yield from create_pool(minsize=1, maxsize=1)
+    assert [(1,), (2,)] == (yield from pool.fetch(
+        'SELECT generate_series(1, %s)', (2,)))
+    assert (1, 'a') == (yield from pool.fetchrow("SELECT 1, 'a'"))
+    assert 'a' == (yield from pool.fetchval("SELECT 1, 'a'", column=1))
+    assert (yield from pool.fetchval('SELECT 1 WHERE false')) is None
+    assert 'SELECT 1' == (yield from pool.execute('SELECT 1'))
+    assert 1 == pool.freesize
+    assert 5 == pool.stats()['acquired']
+
+
+@asyncio.coroutine
+def test_fetch_error_releases_connection(create_pool):
+    pool = yield from create_pool(minsize=1, maxsize=1)
+    with pytest.raises(psycopg2.ProgrammingError):
+        yield from pool.fetch('SELECT * FROM no_such_table')
+    assert 1 == pool.freesize
+    assert 1 == (yield from pool.fetchval('SELECT 1'))
+
+
+@asyncio.coroutine
+def test_drain(create_pool, loop):
+    pool = yield from create_pool(minsize=2)
+    conn = yield from pool.acquire()
+    loop.call_later(0.05, pool.release, conn)
+    yield from pool.drain(timeout=5)
+    assert pool.closed
+    assert conn.closed
+    assert 0 == pool.freesize
+    with pytest.raises(RuntimeError):
+        yield from pool.acquire()
+
+
+@asyncio.coroutine
+def test_drain_timeout_cancels_queries(create_pool, loop):
+    pool = yield from create_pool(minsize=1)
+
+    @asyncio.coroutine
+    def sleeper():
+        conn = yield from pool.acquire()
+        try:
+            cur = yield from conn.cursor()
+            yield from cur.execute('SELECT pg_sleep(10)')
+        finally:
+            pool.release(conn)
+
+    task = ensure_future(sleeper(), loop=loop)
+    yield from asyncio.sleep(0.05, loop=loop)
+    started = loop.time()
+    yield from pool.drain(timeout=0.1)
+    assert loop.time() - started < 5
+    assert pool.closed
+    with pytest.raises((asyncio.CancelledError, psycopg2.Error)):
+        yield from task
+    assert 0 == pool.size
+
+
+@asyncio.coroutine
+def test_drain_deadline_with_hanging_cancel(create_pool, loop):
+    pool = yield from create_pool(minsize=1)
+    conn = yield from pool.acquire()
+    cur = yield from conn.cursor()
+    task = ensure_future(cur.execute('SELECT pg_sleep(10)'), loop=loop)
+    yield from asyncio.sleep(0.05, loop=loop)
+
+    @asyncio.coroutine
+    def cancel():
+        # the server ignores the cancellation
+        yield from asyncio.sleep(10, loop=loop)
+
+    conn.cancel = cancel
+    started = loop.time()
+    with mock.patch('aiopg.pool.DRAIN_CANCEL_TIMEOUT', 0.1):
+        yield from pool.drain(timeout=0.1)
+    assert loop.time() - started < 1
+    assert pool.closed
+    assert conn.closed
+    with pytest.raises(psycopg2.Error):
+        yield from task
+    pool.release(conn)
+
+
+@asyncio.coroutine
+def test_drain_idle_connection(create_pool, loop):
+    pool = yield from create_pool(minsize=1)
+    conn = yield from pool.acquire()
+    yield from pool.drain(timeout=0.01)
+    assert pool.closed
+    assert conn.closed
+    pool.release(conn)
+
+
+@asyncio.coroutine
+def test_invalid_target_wait(create_pool):
+    with pytest.raises(ValueError):
+        yield from create_pool(target_wait=0)
+    with pytest.raises(ValueError):
+        yield from create_pool(maxsize=0, target_wait=0.1)
+
+
+@asyncio.coroutine
+def test_adaptive_size_static_by_default(create_pool):
+    pool = yield from create_pool(minsize=0, maxsize=4)
+    assert pool.target_wait is None
+    assert 4 == pool.size_limit
+    assert pool._maintenance_task is None
+
+
+@asyncio.coroutine
+def test_adaptive_size_grows_on_waits(create_pool, loop):
+    pool = yield from create_pool(minsize=0, maxsize=4, target_wait=0.001)
+    assert 0.001 == pool.target_wait
+    assert 1 == pool.size_limit
+    conn = yield from pool.acquire()
+    task = ensure_future(pool.acquire(), loop=loop)
+    yield from asyncio.sleep(0.02, loop=loop)
+    pool.release(conn)
+    pool.release((yield from task))
+
+    with mock.patch('aiopg.pool.logger') as m_log:
+        pool._adapt_size()
+    assert 2 == pool.size_limit
+    assert m_log.info.called
+    assert 1 == pool.stats()['grown']
+    assert 2 == pool.stats()['size_limit']
+
+    conn1 = yield from pool.acquire()
+    conn2 = yield from pool.acquire()
+    assert 2 == pool.size
+    pool.release(conn1)
+    pool.release(conn2)
+
+
+@asyncio.coroutine
+def test_adaptive_size_grows_for_stuck_waiters(create_pool, loop):
+    pool = yield from create_pool(minsize=0, maxsize=3, target_wait=1)
+    conn1 = yield from pool.acquire()
+    pool._adapt_size()
+    task = ensure_future(pool.acquire(), loop=loop)
+    yield from asyncio.sleep(0.01, loop=loop)
+    pool._adapt_size()
+    assert 2 == pool.size_limit
+    conn2 = yield from task
+    assert conn2 is not conn1
+    pool.release(conn1)
+    pool.release(conn2)
+
+
+@asyncio.coroutine
+def test_adaptive_size_shrinks_when_idle(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=8, target_wait=0.1)
+    pool._size_limit = 4
+    conns = []
+    for _ in range(4):
+        conns.append((yield from pool.acquire()))
+    for conn in conns:
+        pool.release(conn)
+    pool._adapt_size()
+    # all connections were used recently
+    assert 4 == pool.size_limit
+
+    pool._adapt_size()
+    assert 3 == pool.size_limit
+    assert 3 == pool.size
+    assert conns[0].closed
+    for _ in range(5):
+        pool._adapt_size()
+    assert 1 == pool.size_limit
+    assert 1 == pool.size
+    assert 3 == pool.stats()['shrunk']
+
+
+@asyncio.coroutine
+def test_adaptive_size_maintenance(create_pool, loop):
+    with mock.patch('aiopg.pool.MAINTENANCE_INTERVAL', 0.01):
+        pool = yield from create_pool(minsize=0, maxsize=4,
+                                      target_wait=0.001)
+    conn = yield from pool.acquire()
+    task = ensure_future(pool.acquire(), loop=loop)
+    yield from asyncio.sleep(0.05, loop=loop)
+    # the stuck waiter gets a new connection without any release
+    conn2 = yield from task
+    assert 2 <= pool.size_limit
+    pool.release(conn)
+    pool.release(conn2)
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="requires fork()")
+@asyncio.coroutine
+def test_forked_process_drops_connections(create_pool):
+    pool = yield from create_pool(minsize=2)
+    conn = yield from pool.acquire()
+    pid = os.fork()
+    if not pid:
+        ok = False
+        try:
+            pool._after_fork()
+            ok = (0 == pool.size and conn.closed)
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert 0 == status
+    # the parent's connections are intact
+    assert 1 == pool.freesize
+    assert 1 == (yield from pool.fetchval('SELECT 1'))
+    assert 1 == (yield from conn.fetchval('SELECT 1'))
+    pool.release(conn)
+
+
+@asyncio.coroutine
+def test_pool_rebuilt_after_fork(create_pool):
+    pool = yield from create_pool(minsize=2)
+    conn1 = yield from pool.acquire()
+    conns = list(pool._free) + [conn1]
+    with mock.patch('aiopg.pool.os') as m_os:
+        m_os.getpid.return_value = -1
+        conn2 = yield from pool.acquire()
+        assert all(conn.closed for conn in conns)
+        assert conn2 not in conns
+        assert 2 == pool.size
+        assert 1 == pool.freesize
+        # releasing an inherited connection is a no-op
+        pool.release(conn1)
+        pool.release(conn2)
+        assert 2 == pool.freesize
+
+
+@asyncio.coroutine
+def test_multi_host_pool(create_pool, pg_params):
+    host = pg_params['host']
+    pool = yield from create_pool(host='{},{}'.format(host, host),
+                                  port=pg_params['port'], minsize=2)
+    assert 2 == pool.freesize
+    assert 1 == (yield from pool.fetchval('SELECT 1'))
+
+
+@asyncio.coroutine
+def test_acquire_timeout_limits_connecting(create_pool, loop, pg_params):
+    pool = yield from create_pool(minsize=0, maxsize=2)
+    # a server accepting connections but never answering
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+        server.bind(('127.0.0.1', 0))
+        server.listen(5)
+        pool._conn_kwargs.update(host='127.0.0.1',
+                                 port=server.getsockname()[1])
+        started = loop.time()
+        with pytest.raises(aiopg.PoolTimeoutError):
+            yield from pool.acquire(timeout=0.1)
+        assert loop.time() - started < 1
+        assert 1 == pool.metrics.timeouts
+        # the cancelled connecting gives the slot back
+        yield from asyncio.sleep(0.05, loop=loop)
+        assert 0 == pool.size
+
+
+@asyncio.coroutine
+def test_acquire_timeout_limits_pre_ping(create_pool, loop):
+    pool = yield from create_pool(minsize=1, maxsize=1, pre_ping_idle=0)
+    conn = pool._pop_free()
+    # no time is left to check the connection, it is kept for others
+    assert (yield from pool._ping(conn, loop.time() - 1)) is None
+    assert 1 == pool.freesize
+    assert 0 == pool.metrics.pings
+    assert not conn.closed
+    assert 1 == (yield from pool.fetchval('SELECT 1'))
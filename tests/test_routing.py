@@ -0,0 +1,181 @@
+import asyncio
+import socket
+
+import psycopg2
+import pytest
+
+import aiopg
+
+
+@pytest.yield_fixture
+def create_routing_pool(loop, pg_params):
+    pools = []
+
+    @asyncio.coroutine
+    def go(**kwargs):
+        params = pg_params.copy()
+        params.update(kwargs)
+        pool = yield from aiopg.create_routing_pool(loop=loop, **params)
+        pools.append(pool)
+        return pool
+
+    yield go
+
+    for pool in pools:
+        pool.terminate()
+
+
+def replica(name, **kwargs):
+    return dict(kwargs, application_name=name)
+
+
+@asyncio.coroutine
+def server_of(conn):
+    return (yield from conn.fetchval('SHOW application_name'))
+
+
+@asyncio.coroutine
+def test_routing(create_routing_pool):
+    pool = yield from create_routing_pool(application_name='primary',
+                                          replicas=[replica('replica')])
+    assert 2 == pool.size
+    assert 1 == len(pool.replicas)
+
+    with (yield from pool) as conn:
+        assert 'primary' == (yield from server_of(conn))
+    conn = yield from pool.acquire(readonly=True)
+    assert 'replica' == (yield from server_of(conn))
+    assert conn in pool.replicas[0]._used
+    pool.release(conn)
+
+    stats = pool.stats()
+    assert 1 == stats['primary']
+    assert 1 == stats['replicas']
+    assert 0 == stats['fallbacks']
+    assert 1 == stats['replica_stats'][0]['acquired']
+
+
+@asyncio.coroutine
+def test_balance_replicas(create_routing_pool):
+    pool = yield from create_routing_pool(
+        replicas=[replica('replica1'), replica('replica2')])
+    conn1 = yield from pool.acquire(readonly=True)
+    conn2 = yield from pool.acquire(readonly=True)
+    # the least loaded replica is chosen
+    assert {'replica1', 'replica2'} == {(yield from server_of(conn1)),
+                                        (yield from server_of(conn2))}
+    pool.release(conn1)
+    pool.release(conn2)
+
+    servers = set()
+    for i in range(4):
+        servers.add((yield from pool.fetchval('SHOW application_name',
+                                              readonly=True)))
+    assert {'replica1', 'replica2'} == servers
+    assert 6 == pool.stats()['replicas']
+
+
+@asyncio.coroutine
+def test_fallback_to_primary(create_routing_pool):
+    # the replica is down since the start
+    pool = yield from create_routing_pool(
+        application_name='primary', replicas=[replica('replica', port=1)])
+    assert 0 == pool.replicas[0].size
+    assert 'primary' == (yield from pool.fetchval('SHOW application_name',
+                                                  readonly=True))
+    assert 1 == pool.stats()['fallbacks']
+
+
+@pytest.yield_fixture
+def hung_server():
+    # a server accepting connections but never answering
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+        server.bind(('127.0.0.1', 0))
+        server.listen(10)
+        yield dict(host='127.0.0.1', port=server.getsockname()[1])
+
+
+@asyncio.coroutine
+def test_hung_replica_skipped(create_routing_pool, hung_server, loop):
+    pool = yield from create_routing_pool(
+        timeout=0.5, replicas=[replica('hung', minsize=0, **hung_server),
+                               replica('replica')])
+    started = loop.time()
+    for i in range(4):
+        assert 'replica' == (yield from pool.fetchval(
+            'SHOW application_name', readonly=True))
+    # only the first read may wait for the hung replica
+    assert loop.time() - started < 1
+    assert 0 == pool.stats()['fallbacks']
+
+
+@asyncio.coroutine
+def test_fallback_from_hung_replica(create_routing_pool, hung_server, loop):
+    pool = yield from create_routing_pool(
+        application_name='primary', timeout=0.5,
+        replicas=[replica('hung', minsize=0, **hung_server)])
+    started = loop.time()
+    for i in range(3):
+        assert 'primary' == (yield from pool.fetchval(
+            'SHOW application_name', readonly=True))
+    assert loop.time() - started < 1
+    assert 3 == pool.stats()['fallbacks']
+
+
+@asyncio.coroutine
+def test_acquire_timeout_not_failed_over(create_routing_pool, hung_server):
+    pool = yield from create_routing_pool(
+        timeout=10, replicas=[replica('hung', minsize=0, **hung_server)])
+    with pytest.raises(aiopg.PoolTimeoutError):
+        yield from pool.acquire(readonly=True, timeout=0.1)
+
+
+@asyncio.coroutine
+def test_fallback_is_read_only(create_routing_pool):
+    pool = yield from create_routing_pool(minsize=1, maxsize=1,
+                                          replicas=[replica('replica',
+                                                            port=1)])
+    conn = yield from pool.acquire(readonly=True)
+    assert 'on' == (yield from conn.fetchval(
+        'SHOW default_transaction_read_only'))
+    with pytest.raises(psycopg2.InternalError):
+        yield from conn.execute('CREATE TEMP TABLE tbl (id int)')
+    yield from pool.release(conn)
+
+    # the same connection is writable for other acquires
+    conn2 = yield from pool.acquire()
+    assert conn2 is conn
+    assert 'off' == (yield from conn2.fetchval(
+        'SHOW default_transaction_read_only'))
+    pool.release(conn2)
+
+
+@asyncio.coroutine
+def test_no_fallback(create_routing_pool):
+    pool = yield from create_routing_pool(
+        fallback=False, replicas=[replica('replica', port=1)])
+    with pytest.raises(psycopg2.OperationalError):
+        yield from pool.acquire(readonly=True)
+    # writes are not affected
+    assert 1 == (yield from pool.fetchval('SELECT 1'))
+
+
+@asyncio.coroutine
+def test_no_replicas(create_routing_pool):
+    pool = yield from create_routing_pool(application_name='primary',
+                                          fallback=False)
+    assert 'primary' == (yield from pool.fetchval('SHOW application_name',
+                                                  readonly=True))
+
+
+@asyncio.coroutine
+def test_close(create_routing_pool):
+    pool = yield from create_routing_pool(replicas=[replica('replica')])
+    conn = yield from pool.acquire(readonly=True)
+    pool.close()
+    pool.release(conn)
+    yield from pool.wait_closed()
+    assert pool.closed
+    assert conn.closed
+    with pytest.raises(RuntimeError):
+        yield from pool.acquire()
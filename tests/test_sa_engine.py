@@ -1,4 +1,5 @@
 import asyncio
+import aiopg
 from aiopg.connection import TIMEOUT
 
 import pytest
@@ -152,3 +153,92 @@ def test_terminate_with_acquired_connections(make_engine):
     yield from engine.wait_closed()
 
     assert conn.closed
+
+
+@asyncio.coroutine
+def test_acquire_timeout(make_engine):
+    engine = yield from make_engine(minsize=1, maxsize=1)
+    with (yield from engine):
+        with pytest.raises(aiopg.PoolTimeoutError):
+            yield from engine.acquire(timeout=0.01)
+
+
+@asyncio.coroutine
+def test_stats(engine):
+    acquired = engine.stats()['acquired']
+    with (yield from engine):
+        stats = engine.stats()
+        assert 1 == stats['used']
+        assert acquired + 1 == stats['acquired']
+    assert engine.metrics is engine._pool.metrics
+    assert acquired + 1 == engine.metrics.hold_time.count
+
+
+def test_circuit_state(engine):
+    assert 'closed' == engine.circuit_state
+
+
+@asyncio.coroutine
+def test_acquire_priority(engine):
+    conn = yield from engine.acquire(priority=1)
+    assert not conn.closed
+    engine.release(conn)
+
+
+@asyncio.coroutine
+def test_acquire_partition(make_engine):
+    engine = yield from make_engine(minsize=0, partitions={'oltp': (1, 2)})
+    conn = yield from engine.acquire(partition='oltp')
+    assert 1 == engine.stats()['partitions']['oltp']['used']
+    engine.release(conn)
+    with pytest.raises(ValueError):
+        yield from engine.acquire(partition='reporting')
+    engine.close()
+    yield from engine.wait_closed()
+
+
+@asyncio.coroutine
+def test_acquire_tenant(make_engine):
+    engine = yield from make_engine(minsize=0, tenant_limit=1)
+    conn = yield from engine.acquire(tenant='acme')
+    assert 1 == engine.stats()['tenants']['acme']['used']
+    engine.release(conn)
+    engine.close()
+    yield from engine.wait_closed()
+
+
+@asyncio.coroutine
+def test_drain(make_engine):
+    engine = yield from make_engine(minsize=1)
+    conn = yield from engine.acquire()
+    yield from engine.drain(timeout=0.01)
+    assert engine.closed
+    assert conn.closed
+
+
+@asyncio.coroutine
+def test_readonly_replicas(make_engine):
+    engine = yield from make_engine(
+        application_name='primary',
+        replicas=[{'application_name': 'replica'}])
+    try:
+        with (yield from engine) as conn:
+            assert 'primary' == (yield from conn.scalar(
+                'SHOW application_name'))
+        conn = yield from engine.acquire(readonly=True)
+        tr = yield from conn.begin()
+        assert 'replica' == (yield from conn.scalar('SHOW application_name'))
+        yield from tr.commit()
+        engine.release(conn)
+        assert 1 == engine.stats()['replicas']
+    finally:
+        engine.close()
+        yield from engine.wait_closed()
+
+
+@asyncio.coroutine
+def test_readonly_without_replicas(make_engine):
+    engine = yield from make_engine()
+    conn = yield from engine.acquire(readonly=True)
+    assert 1 == (yield from conn.scalar('SELECT 1'))
+    engine.release(conn)
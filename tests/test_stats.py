@@ -0,0 +1,35 @@
+from aiopg.stats import Histogram
+
+
+def test_histogram_observe():
+    hist = Histogram(bounds=(1, 2, 3))
+    hist.observe(0.5)
+    hist.observe(1)
+    hist.observe(2.5)
+    hist.observe(10)
+    assert 4 == hist.count
+    assert 14 == hist.sum
+    assert 10 == hist.max
+    assert {'count': 4, 'sum': 14, 'max': 10,
+            'buckets': [(1, 2), (2, 0), (3, 1),
+                        (float('inf'), 1)]} == hist.snapshot()
+
+
+def test_histogram_quantile():
+    hist = Histogram(bounds=(1, 2, 3))
+    assert hist.quantile(0.5) is None
+    for value in (0.1, 0.2, 1.5, 2.5):
+        hist.observe(value)
+    assert 1 == hist.quantile(0.5)
+    assert 2.5 == hist.quantile(0.95)
+    hist.observe(7)
+    assert 7 == hist.quantile(1)
+
+
+def test_histogram_reset():
+    hist = Histogram()
+    hist.observe(1)
+    hist.reset()
+    assert 0 == hist.count
+    assert 0 == hist.sum
+    assert hist.quantile(0.5) is None